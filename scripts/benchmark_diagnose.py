@@ -0,0 +1,119 @@
+"""
+Benchmark: MultiAgentDiagnosticSystem.diagnose on the local LLM backend
+Runs without network access, so orchestration overhead and regressions
+can be measured on build machines. For each scenario (specialty count x
+debate rounds) it reports LLM calls, tokens, p50/p99 case latency and
+throughput.
+
+Usage: python -m scripts.benchmark_diagnose [--cases N] [--concurrency N]
+           [--median S] [--sigma X] [--failure-rate P] [--seed N]
+"""
+
+import argparse
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+
+from src.agents.diagnostic_system import MultiAgentDiagnosticSystem
+from src.agents.llm_backend import LocalBackend
+
+# Analyzer summaries carrying keywords of 1, 2 or 3 specialties; the
+# "consulted" column shows how many the router actually selected
+CASE_SUMMARIES = {
+    1: "Male, 65. Chest pain for 3 days, hypertension history.",
+    2: "Male, 65. Chest pain for 3 days; MRI shows a lesion.",
+    3: "Male, 65. Chest pain for 3 days; MRI shows a malignant tumor."
+}
+
+SPECIALIST_TEMPLATE = "[{model}] opinion #{call}: findings reviewed, follow-up advised."
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def run_scenario(specialties, debate_rounds, cases=50, concurrency=8,
+                 latency=None, failure_rate=0.0, seed=0):
+    """
+    Diagnose ``cases`` documents and collect metrics
+
+    Returns:
+        Dict with cases, consulted (mean specialists per case), calls,
+        failures, tokens, p50, p99 (seconds per case) and throughput
+        (cases per second)
+    """
+    backend = LocalBackend(
+        latency=latency if latency is not None else 0.0,
+        responses={
+            'ernie-4.5-8b': CASE_SUMMARIES[specialties],
+            'default': SPECIALIST_TEMPLATE
+        },
+        failure_rate=failure_rate,
+        seed=seed
+    )
+    system = MultiAgentDiagnosticSystem({
+        'enable_debate': debate_rounds > 0,
+        'max_debate_rounds': debate_rounds
+    })
+    # Agents are built lazily and pick up the system's backend
+    system.backend = backend
+
+    def one_case(index):
+        start = time.perf_counter()
+        report = system.diagnose({'raw_text': f"case {index}", 'confidence': 0.95})
+        return time.perf_counter() - start, report['metadata']['num_specialists']
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one_case, range(cases)))
+    wall = time.perf_counter() - wall_start
+    system.shutdown()
+
+    latencies = [latency for latency, _ in results]
+
+    return {
+        'specialties': specialties,
+        'debate_rounds': debate_rounds,
+        'cases': cases,
+        'consulted': sum(n for _, n in results) / cases,
+        'calls': backend.stats['calls'],
+        'failures': backend.stats['failures'],
+        'tokens': backend.stats['prompt_tokens'] + backend.stats['completion_tokens'],
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+        'throughput': cases / wall
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=8, help='cases in parallel')
+    parser.add_argument('--median', type=float, default=0.05, help='median LLM latency (s)')
+    parser.add_argument('--sigma', type=float, default=0.5, help='lognormal latency sigma')
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    logger.remove()
+    latency = {'distribution': 'lognormal', 'median': args.median, 'sigma': args.sigma}
+
+    print(f"{'target':>6} {'consulted':>9} {'rounds':>6} {'calls':>7} {'tokens':>8} "
+          f"{'p50 (s)':>8} {'p99 (s)':>8} {'cases/s':>8}")
+    for specialties in (1, 2, 3):
+        for rounds in (0, 1, 3):
+            result = run_scenario(specialties, rounds, args.cases, args.concurrency,
+                                  latency, args.failure_rate, args.seed)
+            print(f"{specialties:>6} {result['consulted']:>9.1f} {rounds:>6} "
+                  f"{result['calls']:>7} {result['tokens']:>8} {result['p50']:>8.3f} "
+                  f"{result['p99']:>8.3f} {result['throughput']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark: OCR image preprocessing
+Times every preprocessing step on a synthetic 12 MP skewed phone photo
+(or the given images) for a few configurations, and optionally PaddleOCR
+text detection on the result, to weigh preprocessing cost against the
+detection time it saves
+
+Usage: python -m scripts.benchmark_preprocessing [IMAGE ...] [--number N]
+           [--ocr]
+"""
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+from loguru import logger
+
+from src.ocr.preprocessing import ImagePreprocessor, rotate
+
+CONFIGURATIONS = {
+    'none': {'enabled': False},
+    'downscale': {'enabled': True, 'max_side': 2560},
+    'gray+deskew': {'enabled': True, 'max_side': 2560, 'color': 'gray', 'deskew': True},
+    'full': {'enabled': True, 'max_side': 2560, 'color': 'binarize', 'deskew': True,
+             'crop_margins': True}
+}
+
+
+def synthetic_photo(width=4000, height=3000, skew=3.0, seed=0):
+    """Off-white page with rows of dark 'text' blocks, noise and a skew"""
+    rng = np.random.default_rng(seed)
+    page = np.full((height, width, 3), 235, dtype=np.uint8)
+    for top in range(400, height - 400, 90):
+        words = rng.integers(300, 700, size=6)
+        left = 500
+        for word in words:
+            page[top:top + 40, left:min(left + word, width - 500)] = 40
+            left += word + 60
+    page = cv2.add(page, rng.integers(0, 20, size=page.shape, dtype=np.uint8))
+    return rotate(page, skew)
+
+
+def run(name, config, images, number, ocr=None):
+    preprocessor = ImagePreprocessor(config)
+    timings = {}
+    detect = 0.0
+    start = time.perf_counter()
+    for _ in range(number):
+        for image in images:
+            output = preprocessor(image, timings)
+            if ocr is not None:
+                detect_start = time.perf_counter()
+                ocr.ocr(output, det=True, rec=False, cls=False)
+                detect += time.perf_counter() - detect_start
+    total = (time.perf_counter() - start - detect) / (number * len(images))
+
+    steps = ', '.join(f"{step} {seconds / (number * len(images)) * 1000:.1f}"
+                      for step, seconds in timings.items()) or '-'
+    shape = 'x'.join(map(str, output.shape[1::-1]))
+    line = f"{name:>12} {shape:>11} {total * 1000:>9.1f}"
+    if ocr is not None:
+        line += f" {detect / (number * len(images)) * 1000:>9.1f}"
+    print(f"{line}   {steps}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='*', help='images to use instead of the synthetic photo')
+    parser.add_argument('--number', type=int, default=5, help='iterations per configuration')
+    parser.add_argument('--ocr', action='store_true', help='also time PaddleOCR detection')
+    args = parser.parse_args()
+
+    logger.remove()
+    images = [cv2.imread(path) for path in args.images] or [synthetic_photo()]
+
+    ocr = None
+    header = f"{'config':>12} {'output':>11} {'prep (ms)':>9}"
+    if args.ocr:
+        from src.ocr.document_processor import create_ocr_engine
+        ocr = create_ocr_engine({'use_gpu': False})
+        header += f" {'det (ms)':>9}"
+    print(f"{header}   per step (ms)")
+
+    for name, config in CONFIGURATIONS.items():
+        run(name, config, images, args.number, ocr)
+
+
+if __name__ == "__main__":
+    main()
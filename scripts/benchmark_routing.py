@@ -0,0 +1,94 @@
+"""
+Micro-benchmark: specialty routing
+Compares the router's per-keyword scan and its compiled keyword
+automaton against the original substring scan, at the default list
+sizes and with synthetic lists of hundreds of terms per specialty
+
+The automaton's cost is per character of case text, the scans' is per
+keyword; the automaton only pulls ahead once the lists reach about a
+hundred terms per specialty, which is where KeywordRouter switches to
+it (AUTOMATON_MIN_KEYWORDS).
+
+Usage: python -m scripts.benchmark_routing [--number N]
+"""
+
+import argparse
+import random
+import string
+import timeit
+
+from src.agents.keyword_router import (AUTOMATON_MIN_KEYWORDS, DEFAULT_SPECIALTY_KEYWORDS,
+                                       KeywordRouter)
+
+
+def legacy_route(text, specialty_keywords):
+    """Original _determine_specialties: one scan of the text per keyword"""
+    text = text.lower()
+    specialties = [s for s, keywords in specialty_keywords.items()
+                   if any(keyword in text for keyword in keywords)]
+    return specialties or ['cardiology']
+
+
+def synthetic_keywords(terms_per_specialty, seed=0):
+    """Default keywords padded with random latin and CJK terms"""
+    rng = random.Random(seed)
+    cjk = [chr(c) for c in range(0x4e00, 0x4e00 + 2000)]
+    keywords = {}
+
+    for specialty, base in DEFAULT_SPECIALTY_KEYWORDS.items():
+        terms = list(base)
+        while len(terms) < terms_per_specialty:
+            if rng.random() < 0.5:
+                terms.append(''.join(rng.choices(string.ascii_lowercase, k=rng.randint(5, 12))))
+            else:
+                terms.append(''.join(rng.choices(cjk, k=rng.randint(2, 4))))
+        keywords[specialty] = terms
+
+    return keywords
+
+
+def sample_case(length, seed=1):
+    rng = random.Random(seed)
+    filler = ['患者', '男性', '65岁', 'patient', 'reports', 'history', 'of',
+              'chest pain', '胸闷', 'ct scan', 'normal', '3天']
+    words = []
+    while sum(len(w) + 1 for w in words) < length:
+        words.append(rng.choice(filler))
+    return ' '.join(words)
+
+
+def run(terms_per_specialty, text_length, number):
+    keywords = synthetic_keywords(terms_per_specialty)
+    specialties = {s: {'keywords': k} for s, k in keywords.items()}
+    scan = KeywordRouter(specialties, automaton_min_keywords=float('inf'))
+    automaton = KeywordRouter(specialties, automaton_min_keywords=0)
+    text = sample_case(text_length)
+
+    assert scan.route(text) == automaton.route(text) == legacy_route(text, keywords)
+    assert scan.match(text) == automaton.match(text)
+
+    def timed(fn):
+        return timeit.timeit(fn, number=number) / number * 1e6
+
+    legacy = timed(lambda: legacy_route(text, keywords))
+    scanned = timed(lambda: scan.route(text))
+    compiled = timed(lambda: automaton.route(text))
+    default = 'automaton' if 3 * terms_per_specialty >= AUTOMATON_MIN_KEYWORDS else 'scan'
+
+    print(f"{terms_per_specialty:>6} terms/specialty  {text_length:>6} chars  "
+          f"legacy {legacy:>9.1f}us  scan {scanned:>9.1f}us  "
+          f"automaton {compiled:>9.1f}us  (default: {default})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=200, help='iterations per measurement')
+    args = parser.parse_args()
+
+    for terms in (len(max(DEFAULT_SPECIALTY_KEYWORDS.values(), key=len)), 100, 500, 2000):
+        for length in (500, 5000):
+            run(terms, length, args.number)
+
+
+if __name__ == "__main__":
+    main()
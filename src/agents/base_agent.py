@@ -1,39 +1,89 @@
-from typing import Dict, List, Optional
+import threading
+import time
+from typing import Dict, Iterator, Optional
 from abc import ABC, abstractmethod
-import erniebot
 from loguru import logger
+from .cache import ResponseCache
+from .case import current_case
+from .history import ConversationHistory
+from .llm_backend import LLMBackend, LLMResponse, estimate_tokens, get_default_backend
+from .prompt_budget import budget_for, build_revision_prompt
+from .rate_limit import get_model_limiter
+from .records import Opinion, StructuredRecord
+from .resilience import get_model_resilience
+from .telemetry import LLMMetrics, get_default_metrics
 
 
 class BaseAgent(ABC):
     
-    def __init__(self, name: str, role: str, model: str = "ernie-4.5-8b"):
+    def __init__(self, name: str, role: str, model: str = "ernie-4.5-8b",
+                 cache: Optional[ResponseCache] = None,
+                 history: Optional[ConversationHistory] = None,
+                 backend: Optional[LLMBackend] = None,
+                 metrics: Optional[LLMMetrics] = None):
         self.name = name
         self.role = role
         self.model = model
-        self.conversation_history = []
+        self.conversation_history = history if history is not None else ConversationHistory()
+        self.cache = cache
+        self.backend = backend
+        self.metrics = metrics
+        self.revision_budget = budget_for(model)
+        self.prompt_stats = {'revision_tokens': 0, 'revision_tokens_saved': 0}
+        self.cache_stats = {'hits': 0, 'misses': 0}
+        self._stats_lock = threading.Lock()
         logger.info(f"Initialized {name} agent with role: {role}")
     
     @abstractmethod
     def get_system_prompt(self) -> str:
         pass
     
-    def analyze(self, data: Dict) -> Dict:
-        system_prompt = self.get_system_prompt()
+    def merge_stats(self, counters: Dict[str, Dict[str, int]]):
+        """Fold a finished case's counters into the agent totals"""
+        with self._stats_lock:
+            for group, values in counters.items():
+                totals = getattr(self, group)
+                for key, amount in values.items():
+                    totals[key] = totals.get(key, 0) + amount
+    
+    def _count(self, group: str, key: str, amount: int = 1):
+        """Bump a stats counter: on the current case, or on the agent outside one"""
+        case = current_case.get()
+        if case is not None:
+            case.count(self, group, key, amount)
+        else:
+            self.merge_stats({group: {key: amount}})
+    
+    def _remember(self, entry: Dict):
+        """
+        Record an exchange
+        
+        Inside a case it only goes to the spill log unless the case
+        keeps history on the agents; outside a case it goes to the
+        agent's own history.
+        """
+        case = current_case.get()
+        if case is not None and not case.keep_history:
+            self.conversation_history.spill(entry)
+        else:
+            self.conversation_history.append(entry)
+    
+    def close(self):
+        """
+        Drop the in-memory history of a retired agent
+        
+        Backend and cache are left attached: a call that picked the
+        agent up just before it was retired may still be running.
+        """
+        self.conversation_history.clear()
+    
+    def analyze(self, data: Dict, use_cache: bool = True) -> Dict:
         user_message = self._format_input(data)
         
         try:
-            response = erniebot.ChatCompletion.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                temperature=0.3,
-                top_p=0.9
-            )
-            
-            result = response.get_result()
-            self.conversation_history.append({
+            result = self._complete(user_message, temperature=0.3, top_p=0.9,
+                                    use_cache=use_cache)
+            self._remember({
                 "input": user_message,
                 "output": result
             })
@@ -44,25 +94,238 @@ class BaseAgent(ABC):
             logger.error(f"Error in {self.name} analysis: {e}")
             return {"error": str(e)}
     
-    def revise(self, other_opinions: Dict[str, Dict]) -> Dict:
+    def revise(self, other_opinions: Dict[str, Dict], use_cache: bool = True) -> Dict:
         revision_prompt = self._create_revision_prompt(other_opinions)
         
         try:
-            response = erniebot.ChatCompletion.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": self.get_system_prompt()},
-                    {"role": "user", "content": revision_prompt}
-                ],
-                temperature=0.4
-            )
+            result = self._complete(revision_prompt, temperature=0.4,
+                                    use_cache=use_cache)
+            return self._parse_response(result)
+            
+        except Exception as e:
+            logger.error(f"Error in {self.name} revision: {e}")
+            return {}
+    
+    def analyze_stream(self, data: Dict, use_cache: bool = True) -> Iterator[Dict]:
+        """
+        Streaming version of analyze()
+        
+        Yields ``{'event': 'token', 'text': ...}`` as completion text
+        arrives, then a single ``{'event': 'result', 'result': ...}`` with
+        the parsed response (or ``{'error': ...}``).
+        """
+        user_message = self._format_input(data)
+        
+        try:
+            chunks = []
+            for chunk in self._complete_stream(user_message, temperature=0.3,
+                                               top_p=0.9, use_cache=use_cache):
+                chunks.append(chunk)
+                yield {'event': 'token', 'text': chunk}
+            
+            result = ''.join(chunks)
+            self._remember({
+                "input": user_message,
+                "output": result
+            })
+            
+            yield {'event': 'result', 'result': self._parse_response(result)}
+            
+        except Exception as e:
+            logger.error(f"Error in {self.name} analysis: {e}")
+            yield {'event': 'result', 'result': {"error": str(e)}}
+    
+    async def analyze_async(self, data: Dict, use_cache: bool = True) -> Dict:
+        """Coroutine version of analyze(), subject to per-model rate limits"""
+        user_message = self._format_input(data)
+        
+        try:
+            result = await self._complete_async(user_message, temperature=0.3,
+                                                top_p=0.9, use_cache=use_cache)
+            self._remember({
+                "input": user_message,
+                "output": result
+            })
             
-            return self._parse_response(response.get_result())
+            return self._parse_response(result)
+            
+        except Exception as e:
+            logger.error(f"Error in {self.name} analysis: {e}")
+            return {"error": str(e)}
+    
+    async def revise_async(self, other_opinions: Dict[str, Dict],
+                           use_cache: bool = True) -> Dict:
+        """Coroutine version of revise(), subject to per-model rate limits"""
+        revision_prompt = self._create_revision_prompt(other_opinions)
+        
+        try:
+            result = await self._complete_async(revision_prompt, temperature=0.4,
+                                                use_cache=use_cache)
+            return self._parse_response(result)
             
         except Exception as e:
             logger.error(f"Error in {self.name} revision: {e}")
             return {}
     
+    def _complete(self, user_message: str, temperature: float,
+                  top_p: Optional[float] = None, use_cache: bool = True) -> str:
+        """
+        Single LLM round trip, served from the response cache when possible
+        
+        Args:
+            user_message: User turn sent after the agent's system prompt
+            temperature: Sampling temperature
+            top_p: Nucleus sampling parameter, omitted when None
+            use_cache: False forces a fresh completion (the result is
+                still stored for later callers)
+            
+        Returns:
+            Raw completion text
+        """
+        request = self._build_request(user_message, temperature, top_p)
+        key, cached = self._cache_lookup(request, use_cache)
+        if cached is not None:
+            return cached
+        
+        backend = self._get_backend()
+        response = get_model_resilience(self.model).call(
+            lambda: self._timed_call(backend.complete, request)
+        )
+        result = response.text
+        
+        if key is not None:
+            self.cache.set(key, result)
+        
+        return result
+    
+    def _complete_stream(self, user_message: str, temperature: float,
+                         top_p: Optional[float] = None,
+                         use_cache: bool = True) -> Iterator[str]:
+        """Streaming _complete(): yields text chunks; a cache hit is one chunk"""
+        request = self._build_request(user_message, temperature, top_p)
+        key, cached = self._cache_lookup(request, use_cache)
+        if cached is not None:
+            yield cached
+            return
+        
+        backend = self._get_backend()
+        chunks = []
+        for chunk in get_model_resilience(self.model).stream(
+            lambda: self._timed_stream(backend.stream, request)
+        ):
+            chunks.append(chunk)
+            yield chunk
+        
+        if key is not None:
+            self.cache.set(key, ''.join(chunks))
+    
+    async def _complete_async(self, user_message: str, temperature: float,
+                              top_p: Optional[float] = None,
+                              use_cache: bool = True) -> str:
+        """Async _complete(); every attempt waits for the model's limiter"""
+        request = self._build_request(user_message, temperature, top_p)
+        key, cached = self._cache_lookup(request, use_cache)
+        if cached is not None:
+            return cached
+        
+        backend = self._get_backend()
+        
+        async def attempt():
+            async with get_model_limiter(self.model):
+                start = time.perf_counter()
+                try:
+                    response = await backend.acomplete(request)
+                except Exception as e:
+                    self._record_call(start, error=e)
+                    raise
+            self._record_call(start, response)
+            return response
+        
+        response = await get_model_resilience(self.model).acall(attempt)
+        result = response.text
+        
+        if key is not None:
+            self.cache.set(key, result)
+        
+        return result
+    
+    def _get_backend(self) -> LLMBackend:
+        return self.backend if self.backend is not None else get_default_backend()
+    
+    def _get_metrics(self) -> LLMMetrics:
+        return self.metrics if self.metrics is not None else get_default_metrics()
+    
+    def _timed_call(self, call, request: Dict) -> LLMResponse:
+        """One backend attempt, recorded in the call metrics"""
+        start = time.perf_counter()
+        try:
+            response = call(request)
+        except Exception as e:
+            self._record_call(start, error=e)
+            raise
+        self._record_call(start, response)
+        return response
+    
+    def _timed_stream(self, stream, request: Dict) -> Iterator[str]:
+        """One streaming backend attempt, recorded in the call metrics"""
+        start = time.perf_counter()
+        chunks = []
+        try:
+            for chunk in stream(request):
+                chunks.append(chunk)
+                yield chunk
+        except Exception as e:
+            self._record_call(start, error=e)
+            raise
+        # Streaming responses carry no usage, so tokens are estimated
+        prompt = '\n'.join(m['content'] for m in request['messages'])
+        self._record_call(start, LLMResponse('', estimate_tokens(prompt),
+                                             estimate_tokens(''.join(chunks))))
+    
+    def _record_call(self, start: float, response: Optional[LLMResponse] = None,
+                     error: Optional[Exception] = None):
+        """Record latency, token usage and outcome of one backend call"""
+        self._get_metrics().record_call(
+            self.name, self.model, time.perf_counter() - start,
+            prompt_tokens=response.prompt_tokens if response is not None else 0,
+            completion_tokens=response.completion_tokens if response is not None else 0,
+            error=error
+        )
+    
+    def _build_request(self, user_message: str, temperature: float,
+                       top_p: Optional[float]) -> Dict:
+        request = {
+            'model': self.model,
+            'messages': [
+                {"role": "system", "content": self.get_system_prompt()},
+                {"role": "user", "content": user_message}
+            ],
+            'temperature': temperature
+        }
+        if top_p is not None:
+            request['top_p'] = top_p
+        return request
+    
+    def _cache_lookup(self, request: Dict, use_cache: bool):
+        """Return (cache key, cached result); both None without a cache"""
+        if self.cache is None:
+            return None, None
+        
+        messages = request['messages']
+        key = ResponseCache.make_key(self.model, messages[0]['content'],
+                                     messages[1]['content'], request['temperature'],
+                                     request.get('top_p'))
+        if use_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self._count('cache_stats', 'hits')
+                self._get_metrics().record_cache_hit(self.name, self.model)
+                logger.debug(f"{self.name} cache hit")
+                return key, cached
+        
+        self._count('cache_stats', 'misses')
+        return key, None
+    
     @abstractmethod
     def _format_input(self, data: Dict) -> str:
         pass
@@ -72,13 +335,13 @@ class BaseAgent(ABC):
         pass
     
     def _create_revision_prompt(self, other_opinions: Dict) -> str:
-        prompt = "Based on the following opinions from other specialists:\n\n"
+        prompt, stats = build_revision_prompt(other_opinions, self.revision_budget)
         
-        for agent_name, opinion in other_opinions.items():
-            prompt += f"**{agent_name}**:\n{opinion.get('summary', '')}\n\n"
-        
-        prompt += "\nPlease revise your analysis considering these perspectives. "
-        prompt += "Maintain your expertise while addressing any conflicts or gaps."
+        self._count('prompt_stats', 'revision_tokens', stats['tokens'])
+        self._count('prompt_stats', 'revision_tokens_saved', stats['saved'])
+        if stats['saved']:
+            logger.info(f"{self.name} revision prompt compacted to {stats['tokens']} tokens "
+                        f"({stats['saved']} saved, budget {self.revision_budget})")
         
         return prompt
 
@@ -112,11 +375,11 @@ Provide the output in JSON format with keys: patient_info, chief_complaint,
 medical_history, examination_results, current_medications."""
     
     def _parse_response(self, response: str) -> Dict:
-        return {
-            "summary": response,
-            "structured_data": {},
-            "confidence": 0.9
-        }
+        return StructuredRecord(
+            summary=response,
+            structured_data={},
+            confidence=0.9
+        )
 
 
 class SpecialistAgent(BaseAgent):
@@ -144,13 +407,13 @@ Please provide:
 4. Risk assessment"""
     
     def _parse_response(self, response: str) -> Dict:
-        return {
-            "specialty": self.specialty,
-            "summary": response,
-            "diagnoses": [],
-            "recommendations": [],
-            "risk_level": "medium"
-        }
+        return Opinion(
+            specialty=self.specialty,
+            summary=response,
+            diagnoses=[],
+            recommendations=[],
+            risk_level="medium"
+        )
 
 
 class CardiologyAgent(SpecialistAgent):
@@ -202,6 +465,20 @@ Analyze imaging reports for:
 Provide detailed imaging analysis and follow-up recommendations."""
 
 
+class RoleAgent(SpecialistAgent):
+    """Agent defined entirely by an ``agents.roles`` config entry"""
+    
+    def __init__(self, role_name: str, model: str = "ernie-4.5-8b",
+                 system_prompt: str = ""):
+        title = role_name.replace('_', ' ').title()
+        BaseAgent.__init__(self, name=title, role=title, model=model)
+        self.specialty = role_name
+        self.system_prompt = system_prompt
+    
+    def get_system_prompt(self) -> str:
+        return self.system_prompt
+
+
 if __name__ == "__main__":
     analyzer = DocumentAnalyzerAgent()
     cardio = CardiologyAgent()
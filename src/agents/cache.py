@@ -0,0 +1,135 @@
+"""
+Content-addressed cache for LLM responses
+In-memory LRU tier with TTL, backed by an optional on-disk tier
+that survives restarts
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from loguru import logger
+
+
+class ResponseCache:
+    """
+    Two-tier cache of raw completion text keyed by request content
+
+    The memory tier holds at most ``max_entries`` responses and evicts
+    the least recently used one first. Both tiers expire entries after
+    ``ttl`` seconds (``None`` disables expiry).
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = 3600,
+                 disk_dir: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'ResponseCache':
+        return cls(
+            max_entries=config.get('max_entries', 1024),
+            ttl=config.get('ttl', 3600),
+            disk_dir=config.get('disk_dir')
+        )
+
+    @staticmethod
+    def make_key(model: str, system_prompt: str, user_message: str,
+                 temperature: Optional[float], top_p: Optional[float]) -> str:
+        payload = json.dumps(
+            [model, system_prompt, user_message, temperature, top_p],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created, value = entry
+                if not self._expired(created, now):
+                    self._entries.move_to_end(key)
+                    return value
+                del self._entries[key]
+
+        entry = self._disk_get(key, now)
+        if entry is not None:
+            created, value = entry
+            self._memory_set(key, created, value)
+            return value
+
+        return None
+
+    def set(self, key: str, value: str):
+        created = time.time()
+        self._memory_set(key, created, value)
+        self._disk_set(key, created, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl is not None and now - created > self.ttl
+
+    def _memory_set(self, key: str, created: float, value: str):
+        with self._lock:
+            self._entries[key] = (created, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _disk_get(self, key: str, now: float):
+        if not self.disk_dir:
+            return None
+
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Unreadable cache entry {path}: {e}")
+            return None
+
+        if self._expired(entry['created'], now):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+        return entry['created'], entry['value']
+
+    def _disk_set(self, key: str, created: float, value: str):
+        if not self.disk_dir:
+            return
+
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'created': created, 'value': value}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to persist cache entry {key}: {e}")
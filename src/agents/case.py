@@ -0,0 +1,59 @@
+"""
+Per-request case context
+State that belongs to one case (its id, history scope and counters)
+lives here rather than on the shared engine and its agents, so one
+engine can serve many threads or coroutines without cross-talk
+"""
+
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+from .history import current_case_id
+
+
+class CaseContext:
+    """
+    Mutable state of a single case
+
+    Each agent call of a case writes only under its own agent's key;
+    totals are folded into the agents once the case ends. Counters take
+    a (per-case, so uncontended) lock because a timed-out call may
+    still be finishing while its agent is asked again.
+
+    Args:
+        case_id: Case identifier, also used to tag history entries
+        keep_history: Send exchanges to the agents' own (shared)
+            history; otherwise they only go to the spill log
+    """
+
+    __slots__ = ('case_id', 'keep_history', 'counters', '_lock')
+
+    def __init__(self, case_id: str, keep_history: bool = False):
+        self.case_id = case_id
+        self.keep_history = keep_history
+        self.counters: Dict[object, Dict[str, Dict[str, int]]] = {}
+        self._lock = threading.Lock()
+
+    def count(self, agent, group: str, key: str, amount: int = 1):
+        """Add ``amount`` to ``agent``'s ``group[key]`` counter for this case"""
+        with self._lock:
+            counters = self.counters.setdefault(agent, {}).setdefault(group, {})
+            counters[key] = counters.get(key, 0) + amount
+
+
+# Case served by the current thread / task
+current_case: ContextVar[Optional[CaseContext]] = ContextVar('current_case', default=None)
+
+
+@contextmanager
+def case_scope(case: CaseContext) -> Iterator[CaseContext]:
+    """Make ``case`` the current case inside the block"""
+    token = current_case.set(case)
+    id_token = current_case_id.set(case.case_id)
+    try:
+        yield case
+    finally:
+        current_case_id.reset(id_token)
+        current_case.reset(token)
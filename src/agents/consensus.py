@@ -0,0 +1,152 @@
+"""
+Agreement metrics for the specialist debate
+Compares opinions with TF-IDF cosine similarity over their summaries,
+or with diagnosis overlap when every opinion lists diagnoses
+"""
+
+import math
+import re
+from itertools import combinations
+from typing import Dict, FrozenSet, List
+
+from .records import Opinion, normalize_diagnoses
+from .records import opinion_fingerprint as _fingerprint
+
+_LATIN_RE = re.compile(r'[a-z0-9]+')
+_CJK_RE = re.compile(r'[\u4e00-\u9fff]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into latin words and CJK character bigrams"""
+    text = text.lower()
+    tokens = _LATIN_RE.findall(text)
+
+    for run in _CJK_RE.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+
+    return tokens
+
+
+def tfidf_vectors(texts: List[str]) -> List[Dict[str, float]]:
+    """Build L2-normalised sparse TF-IDF vectors for a small set of texts"""
+    docs = [tokenize(text) for text in texts]
+
+    doc_freq = {}
+    for tokens in docs:
+        for term in set(tokens):
+            doc_freq[term] = doc_freq.get(term, 0) + 1
+
+    # Smoothed idf so terms shared by every opinion still carry weight
+    n = len(docs)
+    idf = {term: math.log((1 + n) / (1 + df)) + 1.0 for term, df in doc_freq.items()}
+
+    vectors = []
+    for tokens in docs:
+        counts = {}
+        for term in tokens:
+            counts[term] = counts.get(term, 0) + 1
+        vector = {term: count * idf[term] for term, count in counts.items()}
+        norm = math.sqrt(sum(w * w for w in vector.values()))
+        if norm:
+            vector = {term: w / norm for term, w in vector.items()}
+        vectors.append(vector)
+
+    return vectors
+
+
+def cosine(a: Dict[str, float], b: Dict[str, float]) -> float:
+    """Cosine similarity of two normalised sparse vectors"""
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(w * b.get(term, 0.0) for term, w in a.items())
+
+
+def text_similarity(a: str, b: str) -> float:
+    """TF-IDF cosine similarity of two texts"""
+    if a == b:
+        return 1.0
+    va, vb = tfidf_vectors([a, b])
+    return cosine(va, vb)
+
+
+def _normalise_diagnoses(opinion: Dict) -> FrozenSet[str]:
+    if isinstance(opinion, Opinion):
+        return opinion.diagnosis_set
+    return normalize_diagnoses(opinion.get('diagnoses'))
+
+
+def agreement_score(opinions: Dict[str, Dict]) -> float:
+    """
+    Mean pairwise agreement between specialist opinions
+
+    Uses Jaccard overlap of the extracted diagnoses when every opinion
+    has some, otherwise TF-IDF cosine similarity of the summaries.
+
+    Returns:
+        Score in [0, 1]; 1.0 for fewer than two opinions
+    """
+    if len(opinions) < 2:
+        return 1.0
+
+    values = list(opinions.values())
+    diagnoses = [_normalise_diagnoses(op) for op in values]
+
+    if all(diagnoses):
+        scores = [len(a & b) / len(a | b) for a, b in combinations(diagnoses, 2)]
+    else:
+        vectors = tfidf_vectors([op.get('summary', '') for op in values])
+        scores = [cosine(a, b) for a, b in combinations(vectors, 2)]
+
+    return sum(scores) / len(scores)
+
+
+def opinion_stability(previous: Dict[str, Dict], current: Dict[str, Dict]) -> float:
+    """
+    How little the opinions changed between two rounds
+
+    Returns:
+        Lowest per-specialist summary similarity between the rounds
+    """
+    shared = [name for name in current if name in previous]
+    if not shared:
+        return 0.0
+
+    return min(
+        text_similarity(previous[name].get('summary', ''), current[name].get('summary', ''))
+        for name in shared
+    )
+
+
+def opinion_fingerprint(opinion: Dict) -> str:
+    """Content hash of the parts of an opinion peers get to see"""
+    if isinstance(opinion, Opinion):
+        return opinion.fingerprint
+    return _fingerprint(opinion.get('summary', ''), _normalise_diagnoses(opinion))
+
+
+def changed_peers(seen: Dict[str, Dict], current: Dict[str, Dict],
+                  threshold: float = 1.0) -> List[str]:
+    """
+    Peers whose opinion materially changed since an agent last saw them
+
+    An opinion is unchanged when its fingerprint matches, or when its
+    diagnoses are the same and its summary is at least ``threshold``
+    similar to the one seen before. Peers the agent has not seen yet
+    always count as changed.
+    """
+    changed = []
+    for name, opinion in current.items():
+        before = seen.get(name)
+        if before is None:
+            changed.append(name)
+        elif opinion_fingerprint(before) == opinion_fingerprint(opinion):
+            continue
+        elif (threshold >= 1.0
+              or _normalise_diagnoses(before) != _normalise_diagnoses(opinion)
+              or text_similarity(before.get('summary', ''),
+                                 opinion.get('summary', '')) < threshold):
+            changed.append(name)
+    return changed
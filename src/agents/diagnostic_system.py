@@ -1,53 +1,133 @@
-from typing import Dict, List, Optional
+import asyncio
+import contextvars
+import copy
+import hashlib
+import json
+import os
+import queue
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import (Awaitable, Callable, Dict, Generator, Iterable, Iterator, List,
+                    Optional, Tuple)
 from loguru import logger
-from .base_agent import (
-    DocumentAnalyzerAgent,
-    CardiologyAgent,
-    OncologyAgent,
-    RadiologyAgent
-)
+from .base_agent import BaseAgent
+from .cache import ResponseCache
+from .consensus import agreement_score, changed_peers, opinion_stability
+from .case import CaseContext, case_scope
+from .history import ConversationHistory
+from .keyword_router import KeywordRouter
+from .llm_backend import create_backend
+from .prompt_budget import budget_for
+from .rate_limit import configure_rate_limits
+from .records import Opinion, Report, ReportVersions, record_text
+from .registry import AgentRegistry, SpecialtyView, role_specialty
+from .resilience import configure_resilience
+from .telemetry import debate_round
 
 
 class MultiAgentDiagnosticSystem:
     
+    # Versions in every report's ``report_versions``
+    REPORT_VERSIONS = ('professional', 'patient_friendly')
+    
     def __init__(self, config: Dict):
         self.config = config
         
-        self.analyzer = DocumentAnalyzerAgent()
-        self.specialists = {
-            'cardiology': CardiologyAgent(),
-            'oncology': OncologyAgent(),
-            'radiology': RadiologyAgent()
-        }
-        
         self.enable_debate = config.get('enable_debate', True)
         self.max_debate_rounds = config.get('max_debate_rounds', 3)
         self.consensus_threshold = config.get('consensus_threshold', 0.85)
+        self.stability_threshold = config.get('stability_threshold', 0.95)
+        self.incremental_debate = config.get('incremental_debate', True)
+        self.peer_change_threshold = config.get('peer_change_threshold', 0.98)
+        self.router = KeywordRouter.from_config(config.get('routing'))
+        
+        # LLM backend shared by all agents (ERNIE API unless configured)
+        self.backend = None
+        if 'llm_backend' in config:
+            self.backend = create_backend(config['llm_backend'])
+        
+        # Per-model token budgets for debate revision prompts
+        self.revision_budgets = config.get('revision_budgets')
+        
+        # Shared LLM response cache
+        cache_config = config.get('response_cache', {})
+        self.response_cache = None
+        if cache_config.get('enabled', False):
+            self.response_cache = ResponseCache.from_config(cache_config)
+        
+        # Bounded, per-case agent history
+        history_config = config.get('history', {})
+        self.history_scope = history_config.get('scope', 'case')
+        self.history_max_entries = history_config.get('max_entries', 20)
+        self.history_spill_dir = history_config.get('spill_dir')
+        
+        # Agents are built from agents.roles on first use
+        self.registry = AgentRegistry(
+            config.get('roles'),
+            idle_ttl=config.get('agent_idle_ttl', 900),
+            on_create=self._configure_agent
+        )
+        self.analyzer_role = config.get('analyzer_role', 'document_analyzer')
+        self._specialty_roles = {}
+        for role in self.registry.roles.values():
+            specialty = role_specialty(role)
+            if specialty is not None:
+                self._specialty_roles[specialty] = role['name']
+        self.specialists = SpecialtyView(self.registry, self._specialty_roles)
+        
+        # Concurrent fan-out of independent agent calls
+        self.parallel_consultation = config.get('parallel_consultation', True)
+        self.max_concurrent_specialists = config.get('max_concurrent_specialists', 4)
+        self.agent_timeout = config.get('agent_timeout', 60)
+        self._executor = ThreadPoolExecutor(
+            max_workers=config.get('agent_workers', 16),
+            thread_name_prefix='medidoc-agent'
+        )
+        
+        if 'rate_limits' in config:
+            configure_rate_limits(config['rate_limits'])
+        
+        # Retries, hedged requests and per-model circuit breakers
+        if 'resilience' in config:
+            configure_resilience(config['resilience'])
         
         logger.info("Multi-Agent Diagnostic System initialized")
     
-    def diagnose(self, document: Dict) -> Dict:
+    def diagnose(self, document: Dict, use_cache: bool = True,
+                 case_id: Optional[str] = None) -> Dict:
+        case_id = case_id or uuid.uuid4().hex
+        with self._case_scope(case_id):
+            report = self._diagnose_case(document, use_cache)
+        report['metadata']['case_id'] = case_id
+        return report
+    
+    def _diagnose_case(self, document: Dict, use_cache: bool) -> Dict:
         logger.info("Starting multi-agent diagnosis")
-        
+        structured_data = self._analysis_stage(document, use_cache)
+        return self._consultation_stage(structured_data, use_cache)
+    
+    def _analysis_stage(self, document: Dict, use_cache: bool) -> Dict:
         logger.info("Step 1: Document analysis")
-        structured_data = self.analyzer.analyze(document)
-        
+        return self.analyzer.analyze(document, use_cache=use_cache)
+    
+    def _consultation_stage(self, structured_data: Dict, use_cache: bool) -> Dict:
         logger.info("Step 2: Determining required specialties")
         required_specialties = self._determine_specialties(structured_data)
         logger.info(f"Required specialties: {required_specialties}")
         
         logger.info("Step 3: Specialist consultation")
-        specialist_opinions = {}
-        for specialty in required_specialties:
-            if specialty in self.specialists:
-                agent = self.specialists[specialty]
-                opinion = agent.analyze(structured_data)
-                specialist_opinions[specialty] = opinion
-                logger.debug(f"{specialty} analysis complete")
+        specialist_opinions, failed_specialists = self._consult_specialists(
+            structured_data, required_specialties, use_cache
+        )
         
+        debate_stats = {}
         if self.enable_debate and len(specialist_opinions) > 1:
             logger.info("Step 4: Agent debate for consensus")
-            consensus = self._debate_and_consensus(specialist_opinions)
+            consensus = self._debate_and_consensus(specialist_opinions, debate_stats,
+                                                   use_cache)
         else:
             consensus = self._merge_opinions(specialist_opinions)
         
@@ -55,47 +135,610 @@ class MultiAgentDiagnosticSystem:
         final_report = self._generate_report(
             structured_data,
             specialist_opinions,
-            consensus
+            consensus,
+            failed_specialists,
+            debate_stats
         )
         
         logger.info("Diagnosis complete")
         return final_report
     
-    def _determine_specialties(self, structured_data: Dict) -> List[str]:
-        specialties = []
-        text = str(structured_data).lower()
+    def diagnose_batch(self, documents: Iterable[Dict],
+                       use_cache: bool = True) -> Iterator[Tuple[int, Dict]]:
+        """
+        Diagnose many documents, yielding (index, report) as cases finish
+        
+        Identical documents are diagnosed once and the report is yielded
+        for every index that submitted them, whether the duplicate arrives
+        while the first case is in flight or after it finished (the last
+        ``batch.completed_reports`` reports are kept for that; failed cases
+        are not kept and run again). Cases run as a two-stage
+        pipeline on separate worker pools, so document analysis of later
+        cases overlaps consultation and debate of earlier ones. At most
+        ``batch.max_in_flight`` distinct cases are in progress at a time
+        and ``documents`` is consumed lazily. A case that raises yields
+        ``{'error': ...}`` for its indices; the batch carries on.
+        
+        Args:
+            documents: Iterable of documents as accepted by diagnose()
+            use_cache: False bypasses the response cache
+            
+        Yields:
+            (index into ``documents``, report) in completion order
+        """
+        batch_config = self.config.get('batch', {})
+        max_in_flight = batch_config.get('max_in_flight', 16)
+        max_completed = batch_config.get('completed_reports', 1024)
+        analysis_pool = ThreadPoolExecutor(
+            max_workers=batch_config.get('analysis_workers', 4),
+            thread_name_prefix='medidoc-batch-analysis'
+        )
+        case_pool = ThreadPoolExecutor(
+            max_workers=batch_config.get('case_workers', 8),
+            thread_name_prefix='medidoc-batch-case'
+        )
+        
+        # One case context spans both stages of a case
+        def analyze(document, case):
+            try:
+                with self._case_scope(case, finish=False):
+                    return self._analysis_stage(document, use_cache)
+            except BaseException:
+                self._finish_case(case)
+                raise
+        
+        def consult(structured_data, case):
+            with self._case_scope(case):
+                report = self._consultation_stage(structured_data, use_cache)
+            report['metadata']['case_id'] = case.case_id
+            return report
+        
+        source = enumerate(documents)
+        exhausted = False
+        groups = {}    # document key -> indices waiting for its report
+        completed = OrderedDict()  # document key -> report, least recently used first
+        pending = {}   # future -> (document key, case context, stage)
+        stats = {'documents': 0, 'unique': 0, 'failed': 0}
+        
+        try:
+            while True:
+                while not exhausted and len(pending) < max_in_flight:
+                    try:
+                        index, document = next(source)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    
+                    stats['documents'] += 1
+                    key = self._document_key(document)
+                    if key in completed:
+                        completed.move_to_end(key)
+                        yield index, copy.deepcopy(completed[key])
+                        continue
+                    if key in groups:
+                        groups[key].append(index)
+                        continue
+                    
+                    groups[key] = [index]
+                    stats['unique'] += 1
+                    case = self._new_case()
+                    future = analysis_pool.submit(analyze, document, case)
+                    pending[future] = (key, case, 'analysis')
+                
+                if not pending:
+                    break
+                
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key, case, stage = pending.pop(future)
+                    
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.error(f"Batch case {case.case_id} failed during {stage}: {e}")
+                        stats['failed'] += 1
+                        result, stage = {'error': str(e)}, 'failed'
+                    
+                    if stage == 'analysis':
+                        follow_up = case_pool.submit(consult, result, case)
+                        pending[follow_up] = (key, case, 'consultation')
+                        continue
+                    
+                    indices = groups.pop(key)
+                    if stage != 'failed' and max_completed > 0:
+                        completed[key] = copy.deepcopy(result)
+                        while len(completed) > max_completed:
+                            completed.popitem(last=False)
+                    yield indices[0], result
+                    for index in indices[1:]:
+                        yield index, copy.deepcopy(result)
+        finally:
+            analysis_pool.shutdown(wait=False, cancel_futures=True)
+            case_pool.shutdown(wait=False, cancel_futures=True)
+            logger.info(f"Batch finished: {stats['documents']} documents, "
+                        f"{stats['unique']} unique, {stats['failed']} failed")
+    
+    @staticmethod
+    def _document_key(document: Dict) -> str:
+        payload = json.dumps(document, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def diagnose_stream(self, document: Dict, use_cache: bool = True,
+                        case_id: Optional[str] = None) -> Iterator[Dict]:
+        """
+        Streaming version of diagnose()
         
-        cardio_keywords = ['heart', 'cardiac', 'chest pain', 'ecg', 'hypertension', 
-                          '心脏', '胸痛', '心电图', '高血压']
-        if any(keyword in text for keyword in cardio_keywords):
-            specialties.append('cardiology')
+        Yields report events as the case progresses so clients can show
+        output long before the whole run finishes:
         
-        onco_keywords = ['tumor', 'cancer', 'malignant', 'chemotherapy', 
-                        '肿瘤', '癌', '化疗']
-        if any(keyword in text for keyword in onco_keywords):
-            specialties.append('oncology')
+        - ``stage``: a pipeline step started
+        - ``token``: completion text from ``source`` (analyzer or a specialty)
+        - ``specialties``: specialties selected for the case
+        - ``opinion`` / ``specialist_failed``: a consultation finished
+        - ``debate_round``: timing and agreement of a finished round
+        - ``report``: the final report, identical to diagnose()'s
+        """
+        case_id = case_id or uuid.uuid4().hex
+        
+        with self._case_scope(case_id):
+            yield {'event': 'stage', 'stage': 'document_analysis', 'case_id': case_id}
+            structured_data = {}
+            for event in self.analyzer.analyze_stream(document, use_cache=use_cache):
+                if event['event'] == 'token':
+                    yield {'event': 'token', 'source': 'analyzer', 'text': event['text']}
+                else:
+                    structured_data = event['result']
+            
+            required_specialties = self._determine_specialties(structured_data)
+            yield {'event': 'specialties', 'specialties': required_specialties}
+            
+            yield {'event': 'stage', 'stage': 'consultation'}
+            tasks = self._consultation_tasks(structured_data, required_specialties)
+            streams = {
+                name: (lambda a=agent, d=data: a.analyze_stream(d, use_cache=use_cache))
+                for name, (agent, data) in tasks.items()
+            }
+            results = {}
+            for source, event in self._stream_fan_out(streams, 'consultation'):
+                if event['event'] == 'token':
+                    yield {'event': 'token', 'source': source, 'text': event['text']}
+                    continue
+                
+                results[source] = event['result']
+                if 'error' in event['result']:
+                    yield {'event': 'specialist_failed', 'specialty': source,
+                           'error': event['result']['error']}
+                else:
+                    yield {'event': 'opinion', 'specialty': source,
+                           'opinion': event['result']}
+            
+            specialist_opinions, failed_specialists = self._split_failures(
+                {name: results[name] for name in tasks}
+            )
+            
+            debate_stats = {}
+            if self.enable_debate and len(specialist_opinions) > 1:
+                yield {'event': 'stage', 'stage': 'debate'}
+                debate = self._debate_rounds(specialist_opinions, debate_stats)
+                reported = 0
+                try:
+                    opinions, stale = next(debate)
+                    while True:
+                        opinions, stale = debate.send(
+                            self._revise_round(opinions, use_cache, stale)
+                        )
+                        for round_stats in debate_stats['rounds'][reported:]:
+                            yield {'event': 'debate_round', **round_stats}
+                        reported = len(debate_stats['rounds'])
+                except StopIteration as finished:
+                    consensus = finished.value
+                for round_stats in debate_stats['rounds'][reported:]:
+                    yield {'event': 'debate_round', **round_stats}
+            else:
+                consensus = self._merge_opinions(specialist_opinions)
+            
+            yield {'event': 'stage', 'stage': 'report'}
+            report = self._generate_report(
+                structured_data,
+                specialist_opinions,
+                consensus,
+                failed_specialists,
+                debate_stats
+            )
+        
+        report['metadata']['case_id'] = case_id
+        yield {'event': 'report', 'report': report}
+    
+    async def diagnose_async(self, document: Dict, use_cache: bool = True,
+                             case_id: Optional[str] = None) -> Dict:
+        """
+        Coroutine version of diagnose()
+        
+        Agent calls go through the async agent API, so a case holds no
+        thread while it waits on the LLM; per-model limits are shared by
+        every case running on the event loop.
+        """
+        case_id = case_id or uuid.uuid4().hex
+        with self._case_scope(case_id):
+            report = await self._diagnose_case_async(document, use_cache)
+        report['metadata']['case_id'] = case_id
+        return report
+    
+    async def _diagnose_case_async(self, document: Dict, use_cache: bool) -> Dict:
+        logger.info("Starting multi-agent diagnosis (async)")
+        
+        structured_data = await self.analyzer.analyze_async(document, use_cache=use_cache)
+        
+        required_specialties = self._determine_specialties(structured_data)
+        logger.info(f"Required specialties: {required_specialties}")
+        
+        tasks = self._consultation_tasks(structured_data, required_specialties)
+        results = await self._fan_out_async(
+            {name: (lambda a=agent, d=data: a.analyze_async(d, use_cache=use_cache))
+             for name, (agent, data) in tasks.items()},
+            'consultation'
+        )
+        specialist_opinions, failed_specialists = self._split_failures(results)
         
-        radio_keywords = ['ct', 'mri', 'x-ray', 'imaging', 'scan',
-                         '影像', '扫描']
-        if any(keyword in text for keyword in radio_keywords):
-            specialties.append('radiology')
+        debate_stats = {}
+        if self.enable_debate and len(specialist_opinions) > 1:
+            debate = self._debate_rounds(specialist_opinions, debate_stats)
+            try:
+                opinions, stale = next(debate)
+                while True:
+                    opinions, stale = debate.send(
+                        await self._revise_round_async(opinions, use_cache, stale)
+                    )
+            except StopIteration as finished:
+                consensus = finished.value
+        else:
+            consensus = self._merge_opinions(specialist_opinions)
         
-        if not specialties:
-            specialties.append('cardiology')
+        return self._generate_report(
+            structured_data,
+            specialist_opinions,
+            consensus,
+            failed_specialists,
+            debate_stats
+        )
+    
+    def _new_case(self, case_id: Optional[str] = None) -> CaseContext:
+        return CaseContext(case_id or uuid.uuid4().hex,
+                           keep_history=self.history_scope != 'case')
+    
+    @contextmanager
+    def _case_scope(self, case, finish: bool = True) -> Iterator[CaseContext]:
+        """
+        Run the block as (part of) one case
         
-        return specialties
+        ``case`` is a CaseContext or a case id. Per-case state lives on
+        the context rather than on the shared agents: with history scope
+        ``case`` the exchanges are not kept in memory at all (only the
+        optional spill log records them), so nothing carries over to the
+        next patient or leaks into a concurrent one.
+        """
+        if not isinstance(case, CaseContext):
+            case = self._new_case(case)
+        with case_scope(case):
+            try:
+                yield case
+            finally:
+                if finish:
+                    self._finish_case(case)
+    
+    def _finish_case(self, case: CaseContext):
+        """Fold the case's counters into the agents' running totals"""
+        for agent, counters in case.counters.items():
+            agent.merge_stats(counters)
     
-    def _debate_and_consensus(self, opinions: Dict[str, Dict]) -> Dict:
+    @property
+    def analyzer(self) -> BaseAgent:
+        return self.registry.get(self.analyzer_role)
+    
+    def get_agent(self, role_name: str) -> BaseAgent:
+        """Agent for any configured role, e.g. ``medication_advisor``"""
+        return self.registry.get(role_name)
+    
+    def _agent_key(self, role_name: str) -> str:
+        """'analyzer', the specialty, or the role name for other roles"""
+        if role_name == self.analyzer_role:
+            return 'analyzer'
+        for specialty, role in self._specialty_roles.items():
+            if role == role_name:
+                return specialty
+        return role_name
+    
+    def _configure_agent(self, role_name: str, agent: BaseAgent):
+        """Attach the shared backend, cache, budgets and history to a new agent"""
+        if self.backend is not None:
+            agent.backend = self.backend
+        if self.revision_budgets is not None:
+            agent.revision_budget = budget_for(agent.model, self.revision_budgets)
+        if self.response_cache is not None:
+            agent.cache = self.response_cache
+        
+        spill_dir = self.history_spill_dir
+        agent.conversation_history = ConversationHistory(
+            max_entries=self.history_max_entries,
+            spill_path=(os.path.join(spill_dir, f"{self._agent_key(role_name)}.jsonl")
+                        if spill_dir else None)
+        )
+    
+    def _all_agents(self) -> Dict:
+        """Agents built so far, keyed by 'analyzer' / specialty / role name"""
+        return {self._agent_key(name): agent for name, agent in self.registry.loaded().items()}
+    
+    def _consult_specialists(self, structured_data: Dict, specialties: List[str],
+                             use_cache: bool = True) -> Tuple[Dict, Dict]:
+        """
+        Fan the case out to every required specialist
+        
+        Args:
+            structured_data: Output of the document analyzer
+            specialties: Specialties selected for this case
+            use_cache: False bypasses the response cache
+            
+        Returns:
+            (opinions, failures) keyed by specialty. A specialist that
+            errors or times out is reported in failures and left out of
+            the opinions so the rest of the case can proceed.
+        """
+        tasks = self._consultation_tasks(structured_data, specialties)
+        results = self._fan_out(
+            {name: (lambda a=agent, d=data: a.analyze(d, use_cache=use_cache))
+             for name, (agent, data) in tasks.items()},
+            'consultation'
+        )
+        return self._split_failures(results)
+    
+    def _consultation_tasks(self, structured_data: Dict,
+                            specialties: List[str]) -> Dict[str, Tuple]:
+        """(agent, input) for every required specialty that has an agent"""
+        return {
+            specialty: (self.specialists[specialty], structured_data)
+            for specialty in specialties
+            if specialty in self.specialists
+        }
+    
+    def _split_failures(self, results: Dict[str, Dict]) -> Tuple[Dict, Dict]:
+        """Separate usable opinions from failed consultations"""
+        opinions = {}
+        failures = {}
+        for specialty, opinion in results.items():
+            if 'error' in opinion:
+                failures[specialty] = opinion['error']
+            else:
+                opinions[specialty] = opinion
+                logger.debug(f"{specialty} analysis complete")
+        
+        if failures:
+            logger.warning(f"Continuing without failed specialists: {list(failures)}")
+        
+        return opinions, failures
+    
+    def _fan_out(self, tasks: Dict[str, Callable[[], Dict]], stage: str) -> Dict[str, Dict]:
+        """
+        Run independent agent calls, concurrently when enabled
+        
+        At most ``max_concurrent_specialists`` calls of one case are in
+        flight at a time. Each call gets ``agent_timeout`` seconds from the
+        moment a worker starts it, so time spent queued behind other cases
+        on the shared pool does not count; calls that raise or time out
+        yield an ``{'error': ...}`` result instead of failing the whole case.
+        
+        Args:
+            tasks: Zero-argument callables keyed by agent name
+            stage: Label used in log messages
+            
+        Returns:
+            Results keyed by agent name, in the order of ``tasks``
+        """
+        results = {}
+        
+        if not self.parallel_consultation or len(tasks) <= 1:
+            for name, task in tasks.items():
+                try:
+                    results[name] = task()
+                except Exception as e:
+                    logger.error(f"{name} {stage} failed: {e}")
+                    results[name] = {'error': str(e)}
+            return results
+        
+        queued = list(tasks.items())
+        pending = {}
+        started = {}  # name -> when a worker began the call
+        
+        def timed(name, task):
+            started[name] = time.monotonic()
+            return task()
+        
+        while queued or pending:
+            while queued and len(pending) < self.max_concurrent_specialists:
+                name, task = queued.pop(0)
+                # Carry the case context over to the worker thread
+                future = self._executor.submit(contextvars.copy_context().run, timed, name, task)
+                pending[future] = name
+            
+            next_deadline = self._next_deadline(started, pending.values())
+            done, _ = wait(
+                pending,
+                timeout=max(0.0, next_deadline - time.monotonic()),
+                return_when=FIRST_COMPLETED
+            )
+            
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    logger.error(f"{name} {stage} failed: {e}")
+                    results[name] = {'error': str(e)}
+            
+            now = time.monotonic()
+            for future in [f for f in pending
+                           if started.get(pending[f], now) + self.agent_timeout <= now]:
+                name = pending.pop(future)
+                logger.error(f"{name} {stage} timed out after {self.agent_timeout}s")
+                results[name] = {'error': f"timed out after {self.agent_timeout}s"}
+        
+        return {name: results[name] for name in tasks}
+    
+    def _next_deadline(self, started: Dict[str, float], names: Iterable[str]) -> float:
+        """
+        Earliest timeout among the started calls of ``names``
+        
+        A call still queued cannot expire before ``agent_timeout`` from
+        now, so that bounds the wait when it starts in the meantime.
+        """
+        first = min((started[name] for name in names if name in started),
+                    default=time.monotonic())
+        return first + self.agent_timeout
+    
+    def _stream_fan_out(self, streams: Dict[str, Callable[[], Iterator[Dict]]],
+                        stage: str) -> Iterator[Tuple[str, Dict]]:
+        """
+        Interleave agent event streams as they produce output
+        
+        Same per-case cap and per-agent timeout (counted from when a
+        worker starts the stream) as _fan_out(). Yields
+        (name, event) pairs; every stream ends with exactly one
+        ``result`` event, synthesised on error or timeout.
+        """
+        if not self.parallel_consultation or len(streams) <= 1:
+            for name, stream in streams.items():
+                try:
+                    for event in stream():
+                        yield name, event
+                except Exception as e:
+                    logger.error(f"{name} {stage} failed: {e}")
+                    yield name, {'event': 'result', 'result': {'error': str(e)}}
+            return
+        
+        events = queue.Queue()
+        started = {}  # name -> when a worker began the stream
+        
+        def pump(name, stream):
+            started[name] = time.monotonic()
+            try:
+                for event in stream():
+                    events.put((name, event))
+            except Exception as e:
+                logger.error(f"{name} {stage} failed: {e}")
+                events.put((name, {'event': 'result', 'result': {'error': str(e)}}))
+        
+        queued = list(streams.items())
+        active = set()
+        
+        while queued or active:
+            while queued and len(active) < self.max_concurrent_specialists:
+                name, stream = queued.pop(0)
+                self._executor.submit(contextvars.copy_context().run, pump, name, stream)
+                active.add(name)
+            
+            next_deadline = self._next_deadline(started, active)
+            try:
+                name, event = events.get(timeout=max(0.0, next_deadline - time.monotonic()))
+            except queue.Empty:
+                name, event = None, None
+            
+            if name in active:
+                yield name, event
+                if event['event'] == 'result':
+                    active.discard(name)
+            
+            now = time.monotonic()
+            for name in [n for n in active
+                         if started.get(n, now) + self.agent_timeout <= now]:
+                active.discard(name)
+                logger.error(f"{name} {stage} timed out after {self.agent_timeout}s")
+                yield name, {'event': 'result',
+                             'result': {'error': f"timed out after {self.agent_timeout}s"}}
+    
+    async def _fan_out_async(self, tasks: Dict[str, Callable[[], Awaitable[Dict]]],
+                             stage: str) -> Dict[str, Dict]:
+        """Async _fan_out() with the same per-case cap, timeout and error handling"""
+        limit = asyncio.Semaphore(
+            self.max_concurrent_specialists if self.parallel_consultation else 1
+        )
+        
+        async def run(name, task):
+            async with limit:
+                try:
+                    return await asyncio.wait_for(task(), self.agent_timeout)
+                except asyncio.TimeoutError:
+                    logger.error(f"{name} {stage} timed out after {self.agent_timeout}s")
+                    return {'error': f"timed out after {self.agent_timeout}s"}
+                except Exception as e:
+                    logger.error(f"{name} {stage} failed: {e}")
+                    return {'error': str(e)}
+        
+        names = list(tasks)
+        results = await asyncio.gather(*(run(name, tasks[name]) for name in names))
+        return dict(zip(names, results))
+    
+    def cache_stats(self) -> Dict[str, Dict]:
+        """Per-agent response cache hit/miss counters"""
+        return {name: dict(agent.cache_stats) for name, agent in self._all_agents().items()}
+    
+    def shutdown(self):
+        """Release the worker threads, the agents and the LLM backend"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.registry.close()
+        if self.backend is not None:
+            self.backend.close()
+    
+    def _determine_specialties(self, structured_data: Dict) -> List[str]:
+        return self.router.route(record_text(structured_data))
+    
+    def _debate_and_consensus(self, opinions: Dict[str, Dict],
+                              stats: Optional[Dict] = None,
+                              use_cache: bool = True) -> Dict:
         """
         CAMEL-AI debate mechanism for reaching consensus
         
+        All revisions of a round are issued concurrently and the round
+        ends once every participant has answered (or timed out), so each
+        round only ever reads the opinions of the previous one. Specialists
+        whose peers' opinions did not materially change since their last
+        revision are not re-queried; their previous revision stands.
+        
         Args:
             opinions: Initial opinions from all specialists
+            stats: Optional dict that receives per-round timing
+            use_cache: False bypasses the response cache
             
         Returns:
             Consensus opinion
         """
+        debate = self._debate_rounds(opinions, stats)
+        try:
+            opinions, stale = next(debate)
+            while True:
+                opinions, stale = debate.send(self._revise_round(opinions, use_cache, stale))
+        except StopIteration as finished:
+            return finished.value
+    
+    def _debate_rounds(self, opinions: Dict[str, Dict],
+                       stats: Optional[Dict] = None) -> Generator[Tuple, Dict, Dict]:
+        """
+        Debate bookkeeping shared by the sync and async drivers
+        
+        Yields (opinions, specialists to re-query) for each round, receives
+        the revisions of those specialists back and finally returns the
+        merged consensus.
+        """
         logger.info("Starting agent debate")
+        if stats is None:
+            stats = {}
+        stats.setdefault('rounds', [])
+        debate_start = time.monotonic()
+        participants = len(opinions)
+        rounds_run = 0
+        calls_reused = 0
+        # Peer opinions each specialist last revised against
+        seen = {}
+        stats['initial_agreement'] = agreement_score(opinions)
+        stats['termination'] = 'max_rounds'
         
         for round_num in range(self.max_debate_rounds):
             logger.debug(f"Debate round {round_num + 1}/{self.max_debate_rounds}")
@@ -103,94 +746,206 @@ class MultiAgentDiagnosticSystem:
             # Check for conflicts
             if not self._has_conflict(opinions):
                 logger.info("Consensus reached without debate")
+                stats['termination'] = 'no_conflict'
                 break
             
-            # Each agent revises opinion based on others
-            revised_opinions = {}
-            for agent_name, agent in self.specialists.items():
-                if agent_name in opinions:
-                    # Get other agents' opinions
-                    other_opinions = {
-                        k: v for k, v in opinions.items() 
-                        if k != agent_name
-                    }
-                    
-                    # Agent revises its opinion
-                    revised = agent.revise(other_opinions)
-                    revised_opinions[agent_name] = revised
+            stale = self._stale_participants(opinions, seen)
+            if not stale:
+                logger.info("No peer opinion changed, nothing left to revise")
+                stats['termination'] = 'stable'
+                break
+            
+            round_start = time.monotonic()
+            with debate_round(round_num + 1):
+                results = yield opinions, stale
+            round_time = time.monotonic() - round_start
+            rounds_run += 1
             
-            opinions = revised_opinions
+            for name in stale:
+                # A failed revision comes back as the previous opinion
+                # object; leave it stale so the next round retries it
+                if results[name] is not opinions[name]:
+                    seen[name] = {k: v for k, v in opinions.items() if k != name}
+            revised_opinions = {name: results.get(name, opinion)
+                                for name, opinion in opinions.items()}
+            reused = len(opinions) - len(stale)
+            calls_reused += reused
+            
+            agreement = agreement_score(revised_opinions)
+            stats['rounds'].append({
+                'round': round_num + 1,
+                'duration': round_time,
+                'revisions': len(stale),
+                'reused': reused,
+                'agreement': agreement
+            })
+            logger.debug(f"Round {round_num + 1} completed in {round_time:.2f}s, "
+                         f"agreement {agreement:.2f}")
+            
+            previous, opinions = opinions, revised_opinions
             
             # Check if consensus reached
-            if self._reached_consensus(opinions):
+            if self._reached_consensus(opinions, previous):
                 logger.info(f"Consensus reached after {round_num + 1} rounds")
+                stats['termination'] = (
+                    'consensus' if agreement >= self.consensus_threshold else 'stable'
+                )
                 break
         
+        stats['rounds_run'] = rounds_run
+        stats['rounds_saved'] = self.max_debate_rounds - rounds_run
+        stats['calls_saved'] = stats['rounds_saved'] * participants
+        stats['calls_reused'] = calls_reused
+        stats['total_duration'] = time.monotonic() - debate_start
+        
+        if stats['rounds_saved']:
+            logger.info(f"Debate stopped early ({stats['termination']}): saved "
+                        f"{stats['rounds_saved']} rounds / {stats['calls_saved']} LLM calls")
+        if calls_reused:
+            logger.info(f"Reused {calls_reused} revisions whose peer opinions were unchanged")
+        
         return self._merge_opinions(opinions)
     
+    def _stale_participants(self, opinions: Dict[str, Dict],
+                            seen: Dict[str, Dict]) -> List[str]:
+        """Participants whose peers changed since their last revision"""
+        if not self.incremental_debate:
+            return list(opinions)
+        
+        stale = []
+        for name in opinions:
+            peers = {k: v for k, v in opinions.items() if k != name}
+            if name not in seen or changed_peers(seen[name], peers,
+                                                 self.peer_change_threshold):
+                stale.append(name)
+        return stale
+    
+    def _revise_round(self, opinions: Dict[str, Dict],
+                      use_cache: bool = True,
+                      participants: Optional[List[str]] = None) -> Dict[str, Dict]:
+        """Run one debate round: each participant revises against its peers"""
+        tasks = {
+            name: (lambda a=agent, others=others: a.revise(others, use_cache=use_cache))
+            for name, (agent, others) in self._revision_tasks(opinions, participants).items()
+        }
+        return self._collect_revisions(opinions, self._fan_out(tasks, 'revision'))
+    
+    async def _revise_round_async(self, opinions: Dict[str, Dict],
+                                  use_cache: bool = True,
+                                  participants: Optional[List[str]] = None) -> Dict[str, Dict]:
+        tasks = {
+            name: (lambda a=agent, others=others: a.revise_async(others, use_cache=use_cache))
+            for name, (agent, others) in self._revision_tasks(opinions, participants).items()
+        }
+        results = await self._fan_out_async(tasks, 'revision')
+        return self._collect_revisions(opinions, results)
+    
+    def _revision_tasks(self, opinions: Dict[str, Dict],
+                        participants: Optional[List[str]] = None) -> Dict[str, Tuple]:
+        """(agent, other agents' opinions) for the given debate participants"""
+        if participants is None:
+            participants = list(opinions)
+        
+        tasks = {}
+        for agent_name in opinions:
+            if agent_name in self.specialists and agent_name in participants:
+                agent = self.specialists[agent_name]
+                # Get other agents' opinions
+                other_opinions = {
+                    k: v for k, v in opinions.items()
+                    if k != agent_name
+                }
+                tasks[agent_name] = (agent, other_opinions)
+        return tasks
+    
+    def _collect_revisions(self, opinions: Dict[str, Dict],
+                           results: Dict[str, Dict]) -> Dict[str, Dict]:
+        revised_opinions = {}
+        for agent_name, revised in results.items():
+            if not revised or 'error' in revised:
+                # Keep the previous opinion rather than dropping the specialist
+                logger.warning(f"{agent_name} revision failed, keeping previous opinion")
+                revised = opinions[agent_name]
+            revised_opinions[agent_name] = revised
+        
+        return revised_opinions
+    
     def _has_conflict(self, opinions: Dict[str, Dict]) -> bool:
         """Check if there are conflicting opinions"""
-        # Simplified conflict detection
-        # In production, would compare diagnoses and recommendations
-        return len(opinions) > 1
+        if len(opinions) < 2:
+            return False
+        return agreement_score(opinions) < self.consensus_threshold
     
-    def _reached_consensus(self, opinions: Dict[str, Dict]) -> bool:
-        """Check if agents have reached consensus"""
-        # Simplified consensus check
-        # In production, would measure opinion similarity
-        return False  # Force full debate rounds for demo
+    def _reached_consensus(self, opinions: Dict[str, Dict],
+                           previous: Optional[Dict[str, Dict]] = None) -> bool:
+        """
+        Check if agents have reached consensus
+        
+        True once the opinions agree to ``consensus_threshold``, or when
+        they stopped changing between rounds (``stability_threshold``)
+        so further rounds would only repeat themselves.
+        """
+        if agreement_score(opinions) >= self.consensus_threshold:
+            return True
+        if previous is not None:
+            return opinion_stability(previous, opinions) >= self.stability_threshold
+        return False
     
     def _merge_opinions(self, opinions: Dict[str, Dict]) -> Dict:
         """Merge multiple specialist opinions into consensus"""
-        merged = {
-            'diagnoses': [],
-            'recommendations': [],
-            'risk_assessment': {},
-            'confidence': 0.0
-        }
+        opinions = [Opinion.of(opinion) for opinion in opinions.values()]
         
         # Collect all diagnoses and recommendations
-        for specialty, opinion in opinions.items():
-            if 'diagnoses' in opinion:
-                merged['diagnoses'].extend(opinion['diagnoses'])
-            if 'recommendations' in opinion:
-                merged['recommendations'].extend(opinion['recommendations'])
+        diagnoses = []
+        recommendations = []
+        for opinion in opinions:
+            diagnoses.extend(opinion.diagnoses)
+            recommendations.extend(opinion.recommendations)
         
         # Calculate average confidence
-        confidences = [op.get('confidence', 0.5) for op in opinions.values()]
-        merged['confidence'] = sum(confidences) / len(confidences) if confidences else 0.5
+        confidences = [opinion.confidence for opinion in opinions]
         
-        return merged
+        return Opinion(
+            diagnoses=diagnoses,
+            recommendations=recommendations,
+            risk_assessment={},
+            confidence=sum(confidences) / len(confidences) if confidences else 0.5
+        )
     
     def _generate_report(self, structured_data: Dict, 
                         specialist_opinions: Dict, 
-                        consensus: Dict) -> Dict:
+                        consensus: Dict,
+                        failed_specialists: Optional[Dict] = None,
+                        debate_stats: Optional[Dict] = None) -> Dict:
         """Generate final diagnostic report"""
-        report = {
+        report = Report({
             'patient_data': structured_data,
             'specialist_consultations': specialist_opinions,
             'consensus_diagnosis': consensus,
-            'report_versions': {
-                'professional': self._generate_professional_report(
+            # Rendered on first access; batch jobs usually never ask
+            'report_versions': ReportVersions({
+                'professional': lambda: self._professional_report_lines(
                     structured_data, specialist_opinions, consensus
                 ),
-                'patient_friendly': self._generate_patient_report(
+                'patient_friendly': lambda: self._patient_report_lines(
                     structured_data, consensus
                 )
-            },
+            }),
             'metadata': {
                 'num_specialists': len(specialist_opinions),
                 'confidence': consensus.get('confidence', 0.0),
-                'debate_enabled': self.enable_debate
+                'debate_enabled': self.enable_debate,
+                'failed_specialists': failed_specialists or {},
+                'debate': debate_stats or {}
             }
-        }
+        })
         
         return report
     
-    def _generate_professional_report(self, data: Dict, opinions: Dict, 
-                                     consensus: Dict) -> str:
+    def _professional_report_lines(self, data: Dict, opinions: Dict,
+                                   consensus: Dict) -> Iterator[str]:
         """Generate professional medical report"""
-        report_lines = [
+        yield from [
             "# DIAGNOSTIC REPORT (PROFESSIONAL VERSION)",
             "",
             "## Patient Information",
@@ -200,10 +955,10 @@ class MultiAgentDiagnosticSystem:
         ]
         
         for specialty, opinion in opinions.items():
-            report_lines.append(f"\n### {specialty.title()}")
-            report_lines.append(opinion.get('summary', 'No summary available'))
+            yield f"\n### {specialty.title()}"
+            yield opinion.get('summary', 'No summary available')
         
-        report_lines.extend([
+        yield from [
             "",
             "## Consensus Diagnosis",
             f"Confidence: {consensus.get('confidence', 0):.1%}",
@@ -211,13 +966,11 @@ class MultiAgentDiagnosticSystem:
             "## Recommendations",
             "- Follow-up in 2 weeks",
             "- Additional tests as needed"
-        ])
-        
-        return '\n'.join(report_lines)
+        ]
     
-    def _generate_patient_report(self, data: Dict, consensus: Dict) -> str:
+    def _patient_report_lines(self, data: Dict, consensus: Dict) -> Iterator[str]:
         """Generate patient-friendly report"""
-        report_lines = [
+        yield from [
             "# Your Health Report",
             "",
             "## What We Found",
@@ -231,8 +984,6 @@ class MultiAgentDiagnosticSystem:
             "## Questions?",
             "Please contact your healthcare provider for any concerns."
         ]
-        
-        return '\n'.join(report_lines)
 
 
 def main():
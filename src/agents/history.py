@@ -0,0 +1,88 @@
+"""
+Bounded conversation history for long-lived agents
+Keeps the most recent exchanges in a ring buffer, optionally spills
+every exchange to an append-only JSONL log, and tags entries with the
+case they belong to
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+from loguru import logger
+
+# Case being processed by the current thread / task
+current_case_id: ContextVar[Optional[str]] = ContextVar('current_case_id', default=None)
+
+
+class ConversationHistory:
+    """
+    Ring buffer of agent exchanges
+
+    Args:
+        max_entries: Entries kept in memory; older ones are dropped
+        spill_path: Optional JSONL file every entry is appended to
+    """
+
+    def __init__(self, max_entries: int = 20, spill_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.spill_path = spill_path
+        self._entries = deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+
+        if spill_path:
+            os.makedirs(os.path.dirname(spill_path) or '.', exist_ok=True)
+
+    def append(self, entry: Dict):
+        entry = self._tag(entry)
+
+        with self._lock:
+            self._entries.append(entry)
+            if self.spill_path:
+                self._spill(entry)
+
+    def spill(self, entry: Dict):
+        """Write ``entry`` to the spill log only, keeping memory untouched"""
+        if not self.spill_path:
+            return
+        entry = self._tag(entry)
+        with self._lock:
+            self._spill(entry)
+
+    def entries(self, case_id: Optional[str] = None) -> List[Dict]:
+        """In-memory entries, optionally only those of one case"""
+        with self._lock:
+            if case_id is None:
+                return list(self._entries)
+            return [e for e in self._entries if e['case_id'] == case_id]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[Dict]:
+        return iter(self.entries())
+
+    def __getitem__(self, index: int) -> Dict:
+        return self.entries()[index]
+
+    @staticmethod
+    def _tag(entry: Dict) -> Dict:
+        entry = dict(entry)
+        entry.setdefault('case_id', current_case_id.get())
+        entry.setdefault('timestamp', time.time())
+        return entry
+
+    def _spill(self, entry: Dict):
+        try:
+            with open(self.spill_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        except OSError as e:
+            logger.warning(f"Failed to spill history to {self.spill_path}: {e}")
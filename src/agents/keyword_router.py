@@ -0,0 +1,227 @@
+"""
+Specialty routing by weighted keyword matches
+Small keyword lists are found with one C-level substring search per
+keyword; large ones are compiled into a multi-pattern automaton
+(Aho-Corasick) matched in a single pass over the case text
+"""
+
+from collections import deque
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+DEFAULT_SPECIALTY_KEYWORDS = {
+    'cardiology': ['heart', 'cardiac', 'chest pain', 'ecg', 'hypertension',
+                   '心脏', '胸痛', '心电图', '高血压'],
+    'oncology': ['tumor', 'cancer', 'malignant', 'chemotherapy',
+                 '肿瘤', '癌', '化疗'],
+    'radiology': ['ct', 'mri', 'x-ray', 'imaging', 'scan',
+                  '影像', '扫描']
+}
+
+# Keyword count from which the pure-Python automaton beats per-keyword
+# str.find scans (see scripts/benchmark_routing.py)
+AUTOMATON_MIN_KEYWORDS = 250
+
+
+def _overlaps_itself(keyword: str) -> bool:
+    """True when two occurrences of ``keyword`` can overlap (e.g. 'aa' in 'aaa')"""
+    return any(keyword[:k] == keyword[-k:] for k in range(1, len(keyword)))
+
+
+def _count_overlapping(text: str, keyword: str) -> int:
+    """Occurrences of ``keyword`` in ``text``, overlapping ones included"""
+    count = 0
+    start = text.find(keyword)
+    while start != -1:
+        count += 1
+        start = text.find(keyword, start + 1)
+    return count
+
+
+class KeywordMatch(NamedTuple):
+    specialty: str
+    keyword: str
+    start: int
+    end: int
+    weight: float
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton over lower-cased keywords
+
+    Each keyword carries a payload; finditer() reports every occurrence
+    of every keyword, overlapping ones included, in one scan.
+    """
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[str, object]]] = [[]]
+        self._built = False
+
+    def add(self, keyword: str, payload: object):
+        keyword = keyword.lower()
+        if not keyword:
+            return
+
+        node = 0
+        for char in keyword:
+            nxt = self._goto[node].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = nxt
+
+        self._output[node].append((keyword, payload))
+        self._built = False
+
+    def build(self):
+        """Compute failure links breadth-first"""
+        pending = deque()
+        for nxt in self._goto[0].values():
+            self._fail[nxt] = 0
+            pending.append(nxt)
+
+        while pending:
+            node = pending.popleft()
+            for char, nxt in self._goto[node].items():
+                pending.append(nxt)
+
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                self._output[nxt] = self._output[nxt] + self._output[self._fail[nxt]]
+
+        self._built = True
+
+    def finditer(self, text: str) -> Iterator[Tuple[int, int, str, object]]:
+        """Yield (start, end, keyword, payload) for each match in ``text``"""
+        if not self._built:
+            self.build()
+
+        goto, fail, output = self._goto, self._fail, self._output
+        node = 0
+
+        for index, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+
+            for keyword, payload in output[node]:
+                yield index - len(keyword) + 1, index + 1, keyword, payload
+
+    def __len__(self) -> int:
+        return len(self._goto)
+
+
+class KeywordRouter:
+    """
+    Route a case to specialties by weighted keyword hits
+
+    Args:
+        specialties: ``{specialty: {'keywords': [...], 'weight': w}}``.
+            A keyword is either a string or ``{'term': ..., 'weight': ...}``
+            overriding the specialty weight.
+        min_score: Summed match weight a specialty needs to be selected
+        default_specialty: Used when no specialty reaches ``min_score``
+        automaton_min_keywords: Keyword count from which matching uses
+            the automaton instead of per-keyword scans; both report the
+            same matches
+    """
+
+    def __init__(self, specialties: Optional[Dict[str, Dict]] = None,
+                 min_score: float = 1.0,
+                 default_specialty: Optional[str] = 'cardiology',
+                 automaton_min_keywords: int = AUTOMATON_MIN_KEYWORDS):
+        if specialties is None:
+            specialties = {name: {'keywords': keywords}
+                           for name, keywords in DEFAULT_SPECIALTY_KEYWORDS.items()}
+
+        self.specialties = list(specialties)
+        self.min_score = min_score
+        self.default_specialty = default_specialty
+        self.keywords: List[Tuple[str, Tuple[str, float]]] = []
+
+        for specialty, spec in specialties.items():
+            base_weight = spec.get('weight', 1.0)
+            for keyword in spec.get('keywords', []):
+                if isinstance(keyword, dict):
+                    term, weight = keyword['term'], keyword.get('weight', base_weight)
+                else:
+                    term, weight = keyword, base_weight
+                if term:
+                    self.keywords.append((term.lower(), (specialty, weight)))
+
+        # (keyword, specialty, weight, overlaps itself) for the scan path
+        self._scan = [(term, specialty, weight, _overlaps_itself(term))
+                      for term, (specialty, weight) in self.keywords]
+        self.automaton = None
+        if len(self.keywords) >= automaton_min_keywords:
+            self.automaton = KeywordAutomaton()
+            for term, payload in self.keywords:
+                self.automaton.add(term, payload)
+            self.automaton.build()
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict]) -> 'KeywordRouter':
+        """Build from the ``agents.routing`` config section"""
+        config = config or {}
+        return cls(
+            specialties=config.get('specialties'),
+            min_score=config.get('min_score', 1.0),
+            default_specialty=config.get('default_specialty', 'cardiology')
+        )
+
+    def finditer(self, text: str) -> Iterator[Tuple[int, int, str, Tuple[str, float]]]:
+        """(start, end, keyword, (specialty, weight)) for each match, overlaps included"""
+        text = text.lower()
+        if self.automaton is not None:
+            yield from self.automaton.finditer(text)
+            return
+
+        for keyword, payload in self.keywords:
+            if keyword not in text:
+                continue
+            start = text.find(keyword)
+            while start != -1:
+                yield start, start + len(keyword), keyword, payload
+                start = text.find(keyword, start + 1)
+
+    def match(self, text: str) -> List[KeywordMatch]:
+        """Every keyword occurrence in ``text`` with its position and weight, by end position"""
+        matches = [
+            KeywordMatch(specialty, keyword, start, end, weight)
+            for start, end, keyword, (specialty, weight) in self.finditer(text)
+        ]
+        # The automaton's order: by end, longer keywords first
+        matches.sort(key=lambda m: (m.end, m.start))
+        return matches
+
+    def score(self, text: str) -> Dict[str, float]:
+        """Summed match weight per specialty (0.0 when not matched)"""
+        scores = {specialty: 0.0 for specialty in self.specialties}
+        if self.automaton is not None:
+            for _, _, _, (specialty, weight) in self.automaton.finditer(text.lower()):
+                scores[specialty] += weight
+            return scores
+
+        text = text.lower()
+        for keyword, specialty, weight, overlapping in self._scan:
+            if keyword in text:
+                count = _count_overlapping(text, keyword) if overlapping else text.count(keyword)
+                scores[specialty] += weight * count
+        return scores
+
+    def route(self, text: str) -> List[str]:
+        """Specialties reaching ``min_score``, in configuration order"""
+        scores = self.score(text)
+        selected = [s for s in self.specialties if scores[s] >= self.min_score]
+
+        if not selected and self.default_specialty:
+            selected.append(self.default_specialty)
+
+        return selected
@@ -0,0 +1,481 @@
+"""
+Pluggable LLM backends for the agents
+ErnieBotBackend talks to the ERNIE API; LocalBackend is a deterministic,
+offline stand-in with configurable latency, templated responses and
+failure injection for tests and benchmarks; CassetteBackend records real
+traffic and replays it offline
+"""
+
+import asyncio
+import gzip
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict, deque
+from typing import Deque, Dict, Iterator, List, Optional, Union
+
+import erniebot
+from loguru import logger
+
+_CJK_RE = re.compile(r'[\u4e00-\u9fff]')
+_WORD_RE = re.compile(r'[^\s\u4e00-\u9fff]+')
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap local token estimate
+
+    Roughly one token per CJK character and 1.3 per latin word, close
+    enough to ERNIE's tokenizer for budgeting and benchmarks.
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    words = len(_WORD_RE.findall(text))
+    return cjk + math.ceil(words * 1.3)
+
+
+class LLMResponse:
+    """Completion text plus token usage"""
+
+    __slots__ = ('text', 'prompt_tokens', 'completion_tokens')
+
+    def __init__(self, text: str, prompt_tokens: int = 0, completion_tokens: int = 0):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+
+class LLMBackendError(Exception):
+    """Raised by a backend when a completion fails"""
+
+
+class LLMBackend(ABC):
+    """
+    Chat completion backend
+
+    ``request`` is an erniebot-style dict: ``model``, ``messages`` and
+    sampling parameters such as ``temperature`` and ``top_p``.
+    """
+
+    @abstractmethod
+    def complete(self, request: Dict) -> LLMResponse:
+        pass
+
+    def stream(self, request: Dict) -> Iterator[str]:
+        """Yield completion text chunks; defaults to one chunk"""
+        yield self.complete(request).text
+
+    async def acomplete(self, request: Dict) -> LLMResponse:
+        return await asyncio.to_thread(self.complete, request)
+
+    def close(self):
+        """Release files or connections held by the backend"""
+
+
+class ErnieBotBackend(LLMBackend):
+    """ERNIE chat completions via the erniebot SDK"""
+
+    def complete(self, request: Dict) -> LLMResponse:
+        response = erniebot.ChatCompletion.create(**request)
+        return self._to_response(response)
+
+    def stream(self, request: Dict) -> Iterator[str]:
+        for response in erniebot.ChatCompletion.create(stream=True, **request):
+            yield response.get_result()
+
+    async def acomplete(self, request: Dict) -> LLMResponse:
+        response = await erniebot.ChatCompletion.acreate(**request)
+        return self._to_response(response)
+
+    @staticmethod
+    def _to_response(response) -> LLMResponse:
+        usage = response.get('usage') or {}
+        return LLMResponse(
+            response.get_result(),
+            prompt_tokens=usage.get('prompt_tokens', 0),
+            completion_tokens=usage.get('completion_tokens', 0)
+        )
+
+
+class LocalBackend(LLMBackend):
+    """
+    Offline, deterministic stand-in for the ERNIE API
+
+    Args:
+        latency: Latency distribution in seconds, either a number or a
+            dict: ``{'distribution': 'fixed', 'value': s}``,
+            ``{'distribution': 'uniform', 'low': s, 'high': s}`` or
+            ``{'distribution': 'lognormal', 'median': s, 'sigma': x}``.
+            A dict keyed by model name selects a distribution per model
+            (``default`` for the rest).
+        responses: Canned responses per model (``default`` for the
+            rest); a list is cycled through. Templates may use
+            ``{model}``, ``{input}`` (the user message) and ``{call}``.
+        failure_rate: Probability that a call raises LLMBackendError
+        seed: Seed for latency sampling and failure injection
+        chunk_size: Characters per chunk in stream()
+        first_token_fraction: Share of the latency spent before the
+            first streamed chunk
+    """
+
+    DEFAULT_TEMPLATE = "[{model}] Assessment of the case:\n{input}"
+
+    def __init__(self, latency: Union[float, Dict] = 0.0,
+                 responses: Optional[Dict[str, Union[str, List[str]]]] = None,
+                 failure_rate: float = 0.0, seed: Optional[int] = None,
+                 chunk_size: int = 16, first_token_fraction: float = 0.2):
+        self.latency = latency
+        self.responses = responses or {}
+        self.failure_rate = failure_rate
+        self.chunk_size = chunk_size
+        self.first_token_fraction = first_token_fraction
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'failures': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+
+    @classmethod
+    def from_config(cls, config: Dict) -> 'LocalBackend':
+        return cls(
+            latency=config.get('latency', 0.0),
+            responses=config.get('responses'),
+            failure_rate=config.get('failure_rate', 0.0),
+            seed=config.get('seed'),
+            chunk_size=config.get('chunk_size', 16),
+            first_token_fraction=config.get('first_token_fraction', 0.2)
+        )
+
+    def reset_stats(self):
+        with self._lock:
+            for key in self.stats:
+                self.stats[key] = 0
+
+    def complete(self, request: Dict) -> LLMResponse:
+        delay, failed, response = self._plan(request)
+        time.sleep(delay)
+        if failed:
+            raise LLMBackendError(f"Injected failure for {request['model']}")
+        return response
+
+    def stream(self, request: Dict) -> Iterator[str]:
+        delay, failed, response = self._plan(request)
+        text = response.text
+        chunks = [text[i:i + self.chunk_size]
+                  for i in range(0, len(text), self.chunk_size)] or ['']
+
+        time.sleep(delay * self.first_token_fraction)
+        if failed:
+            raise LLMBackendError(f"Injected failure for {request['model']}")
+
+        gap = delay * (1 - self.first_token_fraction) / len(chunks)
+        for index, chunk in enumerate(chunks):
+            if index:
+                time.sleep(gap)
+            yield chunk
+
+    async def acomplete(self, request: Dict) -> LLMResponse:
+        delay, failed, response = self._plan(request)
+        await asyncio.sleep(delay)
+        if failed:
+            raise LLMBackendError(f"Injected failure for {request['model']}")
+        return response
+
+    def _plan(self, request: Dict):
+        """Sample latency and failure and render the response for one call"""
+        model = request['model']
+        user_message = request['messages'][-1]['content']
+        prompt = '\n'.join(m['content'] for m in request['messages'])
+
+        with self._lock:
+            call = self.stats['calls']
+            self.stats['calls'] += 1
+            delay = self._sample_latency(model)
+            failed = self._rng.random() < self.failure_rate
+            if failed:
+                self.stats['failures'] += 1
+
+        text = self._render(model, user_message, call)
+        response = LLMResponse(text, estimate_tokens(prompt), estimate_tokens(text))
+
+        if not failed:
+            with self._lock:
+                self.stats['prompt_tokens'] += response.prompt_tokens
+                self.stats['completion_tokens'] += response.completion_tokens
+
+        return delay, failed, response
+
+    def _render(self, model: str, user_message: str, call: int) -> str:
+        template = self.responses.get(model, self.responses.get('default', self.DEFAULT_TEMPLATE))
+        if isinstance(template, list):
+            template = template[call % len(template)]
+        return template.format(model=model, input=user_message, call=call)
+
+    def _sample_latency(self, model: str) -> float:
+        spec = self.latency
+        if isinstance(spec, dict) and 'distribution' not in spec:
+            spec = spec.get(model, spec.get('default', 0.0))
+
+        if isinstance(spec, (int, float)):
+            return float(spec)
+
+        distribution = spec['distribution']
+        if distribution == 'fixed':
+            return float(spec['value'])
+        if distribution == 'uniform':
+            return self._rng.uniform(spec['low'], spec['high'])
+        if distribution == 'lognormal':
+            return self._rng.lognormvariate(math.log(spec['median']), spec['sigma'])
+
+        raise ValueError(f"Unknown latency distribution: {distribution}")
+
+
+class CassetteMissError(LLMBackendError):
+    """Raised on replay when the cassette holds no response for a request"""
+
+
+# Failures the same request may not hit again: timeouts, dropped
+# connections, rate limiting and backend errors such as injected faults
+TRANSIENT_ERRORS = (
+    LLMBackendError, TimeoutError, ConnectionError,
+    erniebot.errors.TimeoutError, erniebot.errors.ConnectionError,
+    erniebot.errors.RateLimitError, erniebot.errors.TryAgain
+)
+
+
+def is_transient(error: BaseException) -> bool:
+    """True when retrying the request could succeed"""
+    return isinstance(error, TRANSIENT_ERRORS) and not isinstance(error, CassetteMissError)
+
+
+class CassetteBackend(LLMBackend):
+    """
+    Record LLM traffic to a cassette file, or replay it without a network
+
+    A cassette is JSON Lines (gzip-compressed when the path ends in
+    ``.gz``), one entry per call: the request key (a hash of model,
+    messages and sampling parameters), model, response text or error,
+    token usage, latency and, for streamed calls, the chunks with their
+    offsets. Prompts are not stored, only their hash, but the responses
+    contain PHI (the analyzer's output is extracted patient text), so
+    cassettes must not be committed or shared.
+
+    On replay, calls with the same request key are served the recorded
+    entries in recording order (the last one repeats), so repeated
+    prompts and retried failures play back as they happened.
+
+    Args:
+        path: Cassette file
+        mode: ``record`` (append to ``path``) or ``replay``
+        backend: Backend whose calls are recorded (record mode only)
+        replay_latency: Sleep for the recorded latencies on replay
+        latency_scale: Multiplier applied to recorded latencies
+    """
+
+    def __init__(self, path: str, mode: str = 'replay',
+                 backend: Optional[LLMBackend] = None,
+                 replay_latency: bool = False, latency_scale: float = 1.0):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        if mode == 'record' and backend is None:
+            raise ValueError("Recording needs a backend to record")
+
+        self.path = path
+        self.mode = mode
+        self.backend = backend
+        self.replay_latency = replay_latency
+        self.latency_scale = latency_scale
+        self.stats = {'recorded': 0, 'replayed': 0, 'misses': 0}
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Deque[Dict]] = defaultdict(deque)
+        self._file = None
+
+        if mode == 'replay':
+            self._load()
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            opener = gzip.open if path.endswith('.gz') else open
+            self._file = opener(path, 'at', encoding='utf-8')
+
+    @classmethod
+    def from_config(cls, config: Dict) -> 'CassetteBackend':
+        mode = config.get('mode', 'replay')
+        backend = None
+        if mode == 'record':
+            backend = create_backend(config.get('backend', {'type': 'ernie'}))
+        return cls(
+            config['path'],
+            mode=mode,
+            backend=backend,
+            replay_latency=config.get('replay_latency', False),
+            latency_scale=config.get('latency_scale', 1.0)
+        )
+
+    @staticmethod
+    def request_key(request: Dict) -> str:
+        payload = {k: v for k, v in request.items() if k != 'stream'}
+        return hashlib.sha256(
+            json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')
+        ).hexdigest()
+
+    def complete(self, request: Dict) -> LLMResponse:
+        if self.mode == 'replay':
+            entry = self._next_entry(request)
+            self._sleep(entry['latency'])
+            return self._to_response(entry)
+
+        start = time.monotonic()
+        try:
+            response = self.backend.complete(request)
+        except Exception as e:
+            self._record(request, start, error=e)
+            raise
+        self._record(request, start, response=response)
+        return response
+
+    def stream(self, request: Dict) -> Iterator[str]:
+        if self.mode == 'replay':
+            entry = self._next_entry(request)
+            chunks = entry.get('chunks')
+            if not chunks:
+                self._sleep(entry['latency'])
+                yield self._to_response(entry).text
+                return
+            elapsed = 0.0
+            for offset, chunk in chunks:
+                self._sleep(offset - elapsed)
+                elapsed = offset
+                yield chunk
+            if 'error' in entry:
+                raise LLMBackendError(entry['error'])
+            return
+
+        start = time.monotonic()
+        chunks = []
+        try:
+            for chunk in self.backend.stream(request):
+                chunks.append([round(time.monotonic() - start, 4), chunk])
+                yield chunk
+        except Exception as e:
+            self._record(request, start, error=e, chunks=chunks)
+            raise
+        text = ''.join(chunk for _, chunk in chunks)
+        self._record(request, start, chunks=chunks, response=LLMResponse(
+            text, estimate_tokens('\n'.join(m['content'] for m in request['messages'])),
+            estimate_tokens(text)
+        ))
+
+    async def acomplete(self, request: Dict) -> LLMResponse:
+        if self.mode == 'replay':
+            entry = self._next_entry(request)
+            if self.replay_latency:
+                await asyncio.sleep(entry['latency'] * self.latency_scale)
+            return self._to_response(entry)
+
+        start = time.monotonic()
+        try:
+            response = await self.backend.acomplete(request)
+        except Exception as e:
+            self._record(request, start, error=e)
+            raise
+        self._record(request, start, response=response)
+        return response
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _load(self):
+        opener = gzip.open if self.path.endswith('.gz') else open
+        with opener(self.path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries[entry['key']].append(entry)
+        logger.info(f"Loaded {sum(map(len, self._entries.values()))} cassette entries "
+                    f"from {self.path}")
+
+    def _next_entry(self, request: Dict) -> Dict:
+        key = self.request_key(request)
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.stats['misses'] += 1
+                raise CassetteMissError(f"No cassette entry for {request['model']} "
+                                        f"request {key[:12]}")
+            entry = entries.popleft() if len(entries) > 1 else entries[0]
+            self.stats['replayed'] += 1
+        return entry
+
+    def _sleep(self, seconds: float):
+        if self.replay_latency and seconds > 0:
+            time.sleep(seconds * self.latency_scale)
+
+    @staticmethod
+    def _to_response(entry: Dict) -> LLMResponse:
+        if 'error' in entry:
+            raise LLMBackendError(entry['error'])
+        return LLMResponse(entry['text'], entry.get('prompt_tokens', 0),
+                           entry.get('completion_tokens', 0))
+
+    def _record(self, request: Dict, start: float, response: Optional[LLMResponse] = None,
+                error: Optional[Exception] = None, chunks: Optional[List] = None):
+        entry = {
+            'key': self.request_key(request),
+            'model': request['model'],
+            'latency': round(time.monotonic() - start, 4)
+        }
+        if response is not None:
+            entry.update(text=response.text, prompt_tokens=response.prompt_tokens,
+                         completion_tokens=response.completion_tokens)
+        if error is not None:
+            entry['error'] = f"{type(error).__name__}: {error}"
+        if chunks:
+            entry['chunks'] = chunks
+
+        line = json.dumps(entry, ensure_ascii=False, separators=(',', ':'))
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line + '\n')
+                self._file.flush()
+                self.stats['recorded'] += 1
+
+
+def create_backend(config: Optional[Dict]) -> LLMBackend:
+    """Build a backend from an ``llm_backend`` config section"""
+    config = config or {}
+    backend_type = config.get('type', 'ernie')
+
+    if backend_type == 'ernie':
+        return ErnieBotBackend()
+    if backend_type == 'local':
+        logger.info("Using local LLM backend")
+        return LocalBackend.from_config(config)
+    if backend_type == 'cassette':
+        logger.info(f"Using LLM cassette {config['path']} ({config.get('mode', 'replay')})")
+        return CassetteBackend.from_config(config)
+
+    raise ValueError(f"Unknown LLM backend type: {backend_type}")
+
+
+_default_backend: Optional[LLMBackend] = None
+
+
+def get_default_backend() -> LLMBackend:
+    """Backend used by agents that were not given one explicitly"""
+    global _default_backend
+    if _default_backend is None:
+        _default_backend = ErnieBotBackend()
+    return _default_backend
+
+
+def set_default_backend(backend: Optional[LLMBackend]):
+    global _default_backend
+    _default_backend = backend
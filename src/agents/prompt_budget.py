@@ -0,0 +1,131 @@
+"""
+Token-budgeted revision prompts
+Keeps debate revision prompts within a fixed per-model token budget by
+compacting peer opinions to their key findings when they do not fit
+"""
+
+import re
+from typing import Dict, List, Tuple
+
+from .llm_backend import estimate_tokens
+
+# Revision prompt budgets in (estimated) tokens
+DEFAULT_REVISION_BUDGETS = {
+    'default': 1024,
+    'ernie-4.5-8b': 1536
+}
+
+REVISION_HEADER = "Based on the following opinions from other specialists:\n\n"
+REVISION_FOOTER = ("\nPlease revise your analysis considering these perspectives. "
+                   "Maintain your expertise while addressing any conflicts or gaps.")
+
+_SENTENCE_RE = re.compile(r'[^\n。！？.!?]+[。！？.!?]?')
+_KEY_LINE_RE = re.compile(r'^\s*(?:\d+[.)、]|[-*•])\s*|diagnos|impression|recommend|risk|诊断|建议|风险',
+                          re.IGNORECASE)
+
+
+def budget_for(model: str, budgets: Dict[str, int] = None) -> int:
+    budgets = budgets or DEFAULT_REVISION_BUDGETS
+    return budgets.get(model, budgets.get('default', DEFAULT_REVISION_BUDGETS['default']))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut ``text`` to at most ``max_tokens`` estimated tokens"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ''
+
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) + 1 <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+
+    return text[:low].rstrip() + '…'
+
+
+def key_findings(opinion: Dict) -> List[str]:
+    """
+    Most informative fragments of an opinion, best first
+
+    Structured fields (diagnoses, recommendations, risk level) lead,
+    followed by summary sentences that look like findings, then the rest
+    of the summary in order.
+    """
+    findings = []
+    if opinion.get('diagnoses'):
+        findings.append(f"Diagnoses: {'; '.join(map(str, opinion['diagnoses']))}")
+    if opinion.get('recommendations'):
+        findings.append(f"Recommendations: {'; '.join(map(str, opinion['recommendations']))}")
+    if opinion.get('risk_level'):
+        findings.append(f"Risk level: {opinion['risk_level']}")
+
+    sentences = [s.strip() for s in _SENTENCE_RE.findall(opinion.get('summary', '')) if s.strip()]
+    key = [s for s in sentences if _KEY_LINE_RE.search(s)]
+    findings.extend(key)
+    findings.extend(s for s in sentences if s not in key)
+
+    return findings
+
+
+def compact_opinion(opinion: Dict, max_tokens: int) -> str:
+    """Key findings of ``opinion`` packed into ``max_tokens``"""
+    lines = []
+    used = 0
+
+    for finding in key_findings(opinion):
+        cost = estimate_tokens(finding)
+        if used + cost > max_tokens:
+            if not lines:
+                lines.append(truncate_to_tokens(finding, max_tokens))
+            break
+        lines.append(finding)
+        used += cost
+
+    return '\n'.join(lines)
+
+
+def build_revision_prompt(other_opinions: Dict[str, Dict], budget: int) -> Tuple[str, Dict]:
+    """
+    Revision prompt for one agent, kept within ``budget`` tokens
+
+    Peers whose full summary fits their share keep it verbatim; the
+    budget they leave unused is shared among the rest, which are
+    compacted to their key findings.
+
+    Returns:
+        (prompt, stats) where stats has ``full_tokens`` (the unbudgeted
+        prompt), ``tokens`` and ``saved``
+    """
+    entries = {name: f"**{name}**:\n{opinion.get('summary', '')}\n\n"
+               for name, opinion in other_opinions.items()}
+    overhead = estimate_tokens(REVISION_HEADER) + estimate_tokens(REVISION_FOOTER)
+    full_tokens = overhead + sum(estimate_tokens(entry) for entry in entries.values())
+
+    if full_tokens <= budget:
+        prompt = REVISION_HEADER + ''.join(entries.values()) + REVISION_FOOTER
+        return prompt, {'full_tokens': full_tokens, 'tokens': full_tokens, 'saved': 0}
+
+    # Water-fill the peer budget, smallest opinions first
+    remaining = max(0, budget - overhead)
+    sections = {}
+    by_size = sorted(entries, key=lambda name: estimate_tokens(entries[name]))
+
+    for position, name in enumerate(by_size):
+        share = remaining // (len(by_size) - position)
+        if estimate_tokens(entries[name]) <= share:
+            sections[name] = entries[name]
+        else:
+            label = f"**{name}** (key findings):\n"
+            body = compact_opinion(other_opinions[name],
+                                   share - estimate_tokens(label))
+            sections[name] = f"{label}{body}\n\n"
+        remaining -= estimate_tokens(sections[name])
+
+    prompt = REVISION_HEADER + ''.join(sections[name] for name in entries) + REVISION_FOOTER
+    tokens = estimate_tokens(prompt)
+    return prompt, {'full_tokens': full_tokens, 'tokens': tokens,
+                    'saved': full_tokens - tokens}
@@ -0,0 +1,99 @@
+"""
+Per-model concurrency and rate limits for async agent calls
+Each model gets a semaphore bounding in-flight requests and a token
+bucket bounding the request rate
+"""
+
+import asyncio
+import time
+import weakref
+from typing import Dict, Optional
+
+DEFAULT_LIMITS = {
+    'max_concurrency': 8,
+    'rate': 5.0,    # requests per second
+    'burst': 10
+}
+
+
+class TokenBucket:
+    """Async token bucket: ``rate`` tokens per second, at most ``capacity`` banked"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 1.0):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity,
+                                   self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+class ModelLimiter:
+    """Bounded concurrency plus rate limiting for one model"""
+
+    def __init__(self, max_concurrency: int, rate: float, burst: int):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.bucket = TokenBucket(rate, burst)
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        try:
+            await self.bucket.acquire()
+        except BaseException:
+            self.semaphore.release()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.semaphore.release()
+
+
+_model_limits: Dict[str, Dict] = {}
+
+# Limiters hold asyncio primitives, so they are kept per event loop
+_limiters = weakref.WeakKeyDictionary()
+
+
+def configure_rate_limits(config: Dict):
+    """
+    Set per-model limits
+
+    Args:
+        config: Mapping of model name (or ``default``) to a dict with
+            ``max_concurrency``, ``rate`` and ``burst``
+    """
+    _model_limits.clear()
+    for model, limits in (config or {}).items():
+        _model_limits[model] = dict(limits)
+    _limiters.clear()
+
+
+def limits_for(model: str) -> Dict:
+    limits = dict(DEFAULT_LIMITS)
+    limits.update(_model_limits.get('default', {}))
+    limits.update(_model_limits.get(model, {}))
+    return limits
+
+
+def get_model_limiter(model: str, loop: Optional[asyncio.AbstractEventLoop] = None) -> ModelLimiter:
+    """Limiter shared by every agent that calls ``model`` on this event loop"""
+    loop = loop or asyncio.get_running_loop()
+    per_loop = _limiters.setdefault(loop, {})
+
+    if model not in per_loop:
+        per_loop[model] = ModelLimiter(**limits_for(model))
+
+    return per_loop[model]
@@ -0,0 +1,245 @@
+"""
+Typed result records passed between the agents
+Opinion, StructuredRecord and Report are dicts (so they serialize and
+index exactly like before) that compute their normalized text and
+other derived values once and cache them until they are modified
+"""
+
+import hashlib
+import json
+import threading
+from collections.abc import Mapping
+from typing import IO, Any, Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional
+
+
+def normalized_text(value: Any) -> str:
+    """
+    Lower-cased text content of a (nested) value, for keyword routing
+
+    Only values contribute, never dict keys, so field names such as
+    ``structured_data`` cannot trigger keywords.
+    """
+    parts = []
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if item is None:
+            continue
+        if isinstance(item, str):
+            parts.append(item)
+        elif isinstance(item, dict):
+            stack.extend(reversed(list(item.values())))
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(reversed(list(item)))
+        else:
+            parts.append(str(item))
+    return ' '.join(parts).lower()
+
+
+def record_text(value: Any) -> str:
+    """Cached text of a record, or the normalized text of anything else"""
+    if isinstance(value, Record):
+        return value.text
+    return normalized_text(value)
+
+
+def normalize_diagnoses(diagnoses: Optional[List]) -> FrozenSet[str]:
+    return frozenset(str(d).strip().lower() for d in diagnoses or [] if str(d).strip())
+
+
+def opinion_fingerprint(summary: str, diagnoses: FrozenSet[str]) -> str:
+    payload = json.dumps([summary, sorted(diagnoses)], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class Record(dict):
+    """dict with a lazily computed, cached normalized text"""
+
+    __slots__ = ('_text',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._invalidate()
+
+    @classmethod
+    def of(cls, data: Dict) -> 'Record':
+        """``data`` itself if it already is a ``cls``, else a ``cls`` copy of it"""
+        return data if isinstance(data, cls) else cls(data)
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = normalized_text(self)
+        return self._text
+
+    def _invalidate(self):
+        self._text = None
+
+    # Top-level mutations drop the cached values; nested values are
+    # treated as immutable once the record is built
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._invalidate()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._invalidate()
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._invalidate()
+
+    def setdefault(self, key, default=None):
+        self._invalidate()
+        return super().setdefault(key, default)
+
+    def pop(self, *args):
+        self._invalidate()
+        return super().pop(*args)
+
+    def popitem(self):
+        self._invalidate()
+        return super().popitem()
+
+    def clear(self):
+        super().clear()
+        self._invalidate()
+
+
+class StructuredRecord(Record):
+    """Document analyzer output: summary, structured_data, confidence"""
+
+    __slots__ = ()
+
+    @property
+    def summary(self) -> str:
+        return self.get('summary', '')
+
+    @property
+    def confidence(self) -> float:
+        return self.get('confidence', 0.0)
+
+
+class Opinion(Record):
+    """
+    Specialist opinion (or merged consensus)
+
+    Keys: specialty, summary, diagnoses, recommendations, risk_level and
+    confidence, all optional.
+    """
+
+    __slots__ = ('_diagnosis_set', '_fingerprint')
+
+    def _invalidate(self):
+        super()._invalidate()
+        self._diagnosis_set = None
+        self._fingerprint = None
+
+    @property
+    def summary(self) -> str:
+        return self.get('summary', '')
+
+    @property
+    def diagnoses(self) -> List:
+        return self.get('diagnoses') or []
+
+    @property
+    def recommendations(self) -> List:
+        return self.get('recommendations') or []
+
+    @property
+    def confidence(self) -> float:
+        return self.get('confidence', 0.5)
+
+    @property
+    def diagnosis_set(self) -> FrozenSet[str]:
+        """Normalized diagnoses, for agreement scoring"""
+        if self._diagnosis_set is None:
+            self._diagnosis_set = normalize_diagnoses(self.get('diagnoses'))
+        return self._diagnosis_set
+
+    @property
+    def fingerprint(self) -> str:
+        """Content hash of what peers see of this opinion"""
+        if self._fingerprint is None:
+            self._fingerprint = opinion_fingerprint(self.summary, self.diagnosis_set)
+        return self._fingerprint
+
+
+class ReportVersions(Mapping):
+    """
+    Rendered report versions, built on first access
+
+    Each renderer returns an iterator of lines. Indexing renders (and
+    memoizes) the whole version; stream() and write() emit it line by
+    line without holding the full text.
+    """
+
+    def __init__(self, renderers: Dict[str, Callable[[], Iterable[str]]]):
+        self._renderers = dict(renderers)
+        self._rendered: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, version: str) -> str:
+        if version not in self._rendered:
+            text = '\n'.join(self._renderers[version]())
+            with self._lock:
+                self._rendered.setdefault(version, text)
+        return self._rendered[version]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._renderers)
+
+    def __len__(self) -> int:
+        return len(self._renderers)
+
+    def __repr__(self) -> str:
+        return f"ReportVersions({list(self._renderers)}, rendered={list(self._rendered)})"
+
+    def __deepcopy__(self, memo):
+        # Renderers close over the case data, which is never modified
+        clone = ReportVersions(self._renderers)
+        clone._rendered = dict(self._rendered)
+        return clone
+
+    def is_rendered(self, version: str) -> bool:
+        return version in self._rendered
+
+    def stream(self, version: str) -> Iterator[str]:
+        """Yield ``version`` in chunks; identical to ``self[version]`` once joined"""
+        if version in self._rendered:
+            yield self._rendered[version]
+            return
+
+        for index, line in enumerate(self._renderers[version]()):
+            yield line if index == 0 else '\n' + line
+
+    def write(self, version: str, fp: IO[str]) -> int:
+        """Write ``version`` to a text file object; returns characters written"""
+        written = 0
+        for chunk in self.stream(version):
+            fp.write(chunk)
+            written += len(chunk)
+        return written
+
+    def to_dict(self, versions: Optional[Iterable[str]] = None) -> Dict[str, str]:
+        """Render ``versions`` (default: all) into a plain dict"""
+        return {version: self[version] for version in (versions or self._renderers)}
+
+
+class Report(Record):
+    """Final diagnostic report"""
+
+    __slots__ = ()
+
+    @property
+    def metadata(self) -> Dict:
+        return self.get('metadata', {})
+
+    @property
+    def versions(self) -> ReportVersions:
+        return self['report_versions']
+
+    @property
+    def consensus(self) -> Dict:
+        return self.get('consensus_diagnosis', {})
@@ -0,0 +1,179 @@
+"""
+Lazy agent registry
+Builds agents from the ``agents.roles`` config on first use and evicts
+the ones that sat idle, so start-up cost scales with the roles cases
+actually need
+"""
+
+import threading
+import time
+from collections.abc import Mapping
+from typing import Callable, Dict, Iterator, List, Optional
+
+from loguru import logger
+
+from .base_agent import (BaseAgent, CardiologyAgent, DocumentAnalyzerAgent,
+                         OncologyAgent, RadiologyAgent, RoleAgent)
+from .prompt_budget import budget_for
+
+# Roles with a dedicated agent class; any other role becomes a RoleAgent
+BUILTIN_AGENTS = {
+    'document_analyzer': DocumentAnalyzerAgent,
+    'cardiology_consultant': CardiologyAgent,
+    'oncology_consultant': OncologyAgent,
+    'radiology_consultant': RadiologyAgent
+}
+
+DEFAULT_ROLES = [
+    {'name': 'document_analyzer', 'model': 'ernie-4.5-8b'},
+    {'name': 'cardiology_consultant', 'model': 'ernie-cardiology'},
+    {'name': 'oncology_consultant', 'model': 'ernie-oncology'},
+    {'name': 'radiology_consultant', 'model': 'ernie-radiology'}
+]
+
+
+def role_specialty(role: Dict) -> Optional[str]:
+    """Specialty a role consults on: ``specialty`` or the ``*_consultant`` prefix"""
+    if 'specialty' in role:
+        return role['specialty']
+    name = role['name']
+    if name.endswith('_consultant'):
+        return name[:-len('_consultant')]
+    return None
+
+
+def build_agent(role: Dict) -> BaseAgent:
+    """Instantiate the agent described by one ``agents.roles`` entry"""
+    name = role['name']
+    if name in BUILTIN_AGENTS:
+        agent = BUILTIN_AGENTS[name]()
+        if role.get('model'):
+            agent.model = role['model']
+            agent.revision_budget = budget_for(agent.model)
+        return agent
+
+    return RoleAgent(
+        role_specialty(role) or name,
+        model=role.get('model', 'ernie-4.5-8b'),
+        system_prompt=role.get('system_prompt', '')
+    )
+
+
+class AgentRegistry:
+    """
+    Agents by role name, created on first use
+
+    Args:
+        roles: ``agents.roles`` entries (name, model, system_prompt and
+            optionally specialty)
+        idle_ttl: Seconds an agent may go unused before eviction;
+            None keeps agents forever
+        on_create: Called with (role name, agent) right after an agent
+            is built, to attach shared backend, cache and history
+    """
+
+    def __init__(self, roles: Optional[List[Dict]] = None,
+                 idle_ttl: Optional[float] = None,
+                 on_create: Optional[Callable[[str, BaseAgent], None]] = None):
+        self.roles = {role['name']: dict(role) for role in (roles or DEFAULT_ROLES)}
+        self.idle_ttl = idle_ttl
+        self.on_create = on_create
+        self.stats = {'created': 0, 'evicted': 0}
+        self._agents: Dict[str, BaseAgent] = {}
+        self._last_used: Dict[str, float] = {}
+        self._last_sweep = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.roles
+
+    def get(self, name: str) -> BaseAgent:
+        """Agent for role ``name``, built on first use"""
+        now = time.monotonic()
+
+        # Lock-free fast path for built agents between eviction sweeps
+        agent = self._agents.get(name)
+        if agent is not None:
+            self._last_used[name] = now
+            if not self._sweep_due(now):
+                return agent
+
+        with self._lock:
+            agent = self._agents.get(name)
+            if agent is None:
+                agent = build_agent(self.roles[name])
+                if self.on_create is not None:
+                    self.on_create(name, agent)
+                self._agents[name] = agent
+                self.stats['created'] += 1
+                logger.debug(f"Created agent for role {name}")
+            self._last_used[name] = now
+            evicted = self._evict_idle(now, keep=name)
+
+        for idle in evicted:
+            idle.close()
+        return agent
+
+    def loaded(self) -> Dict[str, BaseAgent]:
+        """Agents built so far, by role name"""
+        with self._lock:
+            return dict(self._agents)
+
+    def evict_idle(self, now: Optional[float] = None) -> List[str]:
+        """Close and drop agents idle for longer than ``idle_ttl``"""
+        with self._lock:
+            before = set(self._agents)
+            evicted = self._evict_idle(now if now is not None else time.monotonic())
+            names = sorted(before - set(self._agents))
+        for agent in evicted:
+            agent.close()
+        return names
+
+    def close(self):
+        with self._lock:
+            agents = list(self._agents.values())
+            self._agents.clear()
+            self._last_used.clear()
+        for agent in agents:
+            agent.close()
+
+    def _sweep_due(self, now: float) -> bool:
+        return self.idle_ttl is not None and now - self._last_sweep >= self.idle_ttl / 4
+
+    def _evict_idle(self, now: float, keep: Optional[str] = None) -> List[BaseAgent]:
+        if self.idle_ttl is None:
+            return []
+
+        self._last_sweep = now
+
+        evicted = []
+        for name, last_used in list(self._last_used.items()):
+            if name != keep and now - last_used > self.idle_ttl:
+                del self._last_used[name]
+                # The fast path may have re-stamped an already evicted role
+                agent = self._agents.pop(name, None)
+                if agent is not None:
+                    evicted.append(agent)
+                    self.stats['evicted'] += 1
+                    logger.debug(f"Evicted idle agent for role {name}")
+        return evicted
+
+
+class SpecialtyView(Mapping):
+    """Read-only specialty -> agent mapping; only indexing builds agents"""
+
+    def __init__(self, registry: AgentRegistry, roles: Dict[str, str]):
+        self._registry = registry
+        self._roles = roles
+
+    def __getitem__(self, specialty: str) -> BaseAgent:
+        return self._registry.get(self._roles[specialty])
+
+    def __contains__(self, specialty) -> bool:
+        return specialty in self._roles
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._roles)
+
+    def __len__(self) -> int:
+        return len(self._roles)
@@ -0,0 +1,388 @@
+"""
+Resilient LLM calls
+Jittered retries, hedged requests once a call exceeds a latency
+percentile, and a per-model circuit breaker that fails fast while a
+model is degraded
+"""
+
+import asyncio
+import contextvars
+import math
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Awaitable, Callable, Dict, Iterator, Optional, TypeVar
+
+from loguru import logger
+
+from .llm_backend import LLMBackendError, is_transient
+
+T = TypeVar('T')
+
+# Hedged requests in flight across all models; no hedge is sent while
+# they are all busy, so a burst of slow calls cannot multiply the spend
+MAX_HEDGES = 8
+
+DEFAULT_RESILIENCE = {
+    'max_attempts': 3,
+    'base_delay': 0.2,        # seconds, doubled per retry (full jitter)
+    'max_delay': 5.0,
+    'hedge_percentile': None,  # e.g. 95 to hedge calls slower than p95
+    'hedge_min_samples': 20,
+    'hedge_window': 200,
+    'failure_threshold': 5,    # consecutive failures that open the breaker
+    'reset_timeout': 30.0      # seconds before a half-open probe
+}
+
+
+class CircuitOpenError(LLMBackendError):
+    """Raised instead of calling a model whose circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker
+
+    Opens after ``failure_threshold`` failures in a row; after
+    ``reset_timeout`` seconds a single probe call is let through and its
+    outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                self._probing = False
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self._failures = 0
+            self._probing = False
+
+    def release(self):
+        """
+        End an attempt that says nothing about the model's health
+        (cancelled, abandoned or rejected as a bad request)
+
+        Frees the half-open probe slot so the next call can probe;
+        otherwise the breaker would reject the model forever.
+        """
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == 'half_open' or self._failures >= self.failure_threshold:
+                if self.state != 'open':
+                    logger.warning(f"Circuit breaker opened after {self._failures} failures")
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+class LatencyTracker:
+    """Rolling window of call latencies"""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, latency: float):
+        with self._lock:
+            self._samples.append(latency)
+
+    def percentile(self, pct: float, min_samples: int = 1) -> Optional[float]:
+        """Nearest-rank percentile, None until ``min_samples`` were observed"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < max(1, min_samples):
+            return None
+        rank = max(1, math.ceil(pct / 100 * len(samples)))
+        return samples[rank - 1]
+
+
+_hedge_executor: Optional[ThreadPoolExecutor] = None
+_hedge_executor_lock = threading.Lock()
+_hedge_slots = threading.BoundedSemaphore(MAX_HEDGES)
+
+
+def _get_hedge_executor() -> ThreadPoolExecutor:
+    global _hedge_executor
+    if _hedge_executor is None:
+        with _hedge_executor_lock:
+            if _hedge_executor is None:
+                _hedge_executor = ThreadPoolExecutor(max_workers=MAX_HEDGES,
+                                                     thread_name_prefix='medidoc-hedge')
+    return _hedge_executor
+
+
+def _start_thread(fn: Callable[[], T], name: str) -> Future:
+    """Run ``fn`` on a thread of its own, started now rather than queued"""
+    future = Future()
+    context = contextvars.copy_context()
+
+    def run():
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(context.run(fn))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+    return future
+
+
+class ModelResilience:
+    """Retry, hedging and circuit breaking for one model"""
+
+    def __init__(self, model: str, max_attempts: int = 3, base_delay: float = 0.2,
+                 max_delay: float = 5.0, hedge_percentile: Optional[float] = None,
+                 hedge_min_samples: int = 20, hedge_window: int = 200,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.model = model
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.latencies = LatencyTracker(hedge_window)
+        self.stats = {'calls': 0, 'retries': 0, 'hedges': 0, 'hedge_wins': 0,
+                      'hedges_skipped': 0, 'rejected': 0}
+        self._lock = threading.Lock()
+        self._rng = random.Random()
+
+    def backoff(self, retry: int) -> float:
+        """Full-jitter exponential backoff before retry number ``retry`` (0-based)"""
+        with self._lock:
+            return self._rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+    def hedge_delay(self) -> Optional[float]:
+        if self.hedge_percentile is None:
+            return None
+        return self.latencies.percentile(self.hedge_percentile, self.hedge_min_samples)
+
+    def call(self, attempt: Callable[[], T]) -> T:
+        """Run ``attempt`` with retries, hedging and the circuit breaker"""
+        self._count('calls')
+        for retry in range(self.max_attempts):
+            self._check_breaker()
+            try:
+                result = self._hedged(attempt)
+            except Exception as e:
+                if not self._failed(e, retry):
+                    raise
+                time.sleep(self.backoff(retry))
+                continue
+            except BaseException:
+                self.breaker.release()
+                raise
+            self.breaker.record_success()
+            return result
+
+    async def acall(self, attempt: Callable[[], Awaitable[T]]) -> T:
+        """Coroutine version of call(); ``attempt`` returns a fresh awaitable"""
+        self._count('calls')
+        for retry in range(self.max_attempts):
+            self._check_breaker()
+            try:
+                result = await self._ahedged(attempt)
+            except Exception as e:
+                if not self._failed(e, retry):
+                    raise
+                await asyncio.sleep(self.backoff(retry))
+                continue
+            except BaseException:
+                # e.g. CancelledError from a caller's timeout
+                self.breaker.release()
+                raise
+            self.breaker.record_success()
+            return result
+
+    def stream(self, open_stream: Callable[[], Iterator[T]]) -> Iterator[T]:
+        """
+        Resilient streaming call
+
+        Failures before the first chunk are retried; once text has been
+        yielded a failure is final. Streams are never hedged.
+        """
+        self._count('calls')
+        for retry in range(self.max_attempts):
+            self._check_breaker()
+            started = False
+            start = time.monotonic()
+            try:
+                for chunk in open_stream():
+                    started = True
+                    yield chunk
+            except Exception as e:
+                if started or not self._failed(e, retry):
+                    if started:
+                        self.breaker.record_failure()
+                    raise
+                time.sleep(self.backoff(retry))
+                continue
+            except BaseException:
+                # GeneratorExit when the consumer drops the stream
+                self.breaker.release()
+                raise
+            self.latencies.observe(time.monotonic() - start)
+            self.breaker.record_success()
+            return
+
+    def _check_breaker(self):
+        if not self.breaker.allow():
+            self._count('rejected')
+            raise CircuitOpenError(f"Circuit open for {self.model}")
+
+    def _failed(self, error: Exception, retry: int) -> bool:
+        """Record a failed attempt; True when it should be retried"""
+        if isinstance(error, CircuitOpenError):
+            return False
+        if not is_transient(error):
+            # Bad request, auth or cassette miss: retrying cannot help
+            # and the model itself is not known to be unhealthy
+            self.breaker.release()
+            return False
+        self.breaker.record_failure()
+        if retry + 1 >= self.max_attempts:
+            return False
+        self._count('retries')
+        logger.warning(f"{self.model} call failed ({type(error).__name__}: {error}), "
+                       f"retry {retry + 1}/{self.max_attempts - 1}")
+        return True
+
+    def _timed(self, attempt: Callable[[], T]) -> T:
+        start = time.monotonic()
+        result = attempt()
+        self.latencies.observe(time.monotonic() - start)
+        return result
+
+    def _hedged(self, attempt: Callable[[], T]) -> T:
+        """
+        Run ``attempt``, hedging it once it is slower than the percentile
+
+        The primary call starts at once on a thread of its own, never
+        queued behind other calls, so the hedge delay measures the
+        model's latency rather than load on a shared pool. Hedges run on
+        a pool of MAX_HEDGES threads and are skipped while it is full.
+        """
+        delay = self.hedge_delay()
+        if delay is None:
+            return self._timed(attempt)
+
+        primary = _start_thread(lambda: self._timed(attempt), f"medidoc-{self.model}")
+        done, _ = wait([primary], timeout=delay)
+        if done or not _hedge_slots.acquire(blocking=False):
+            if not done:
+                self._count('hedges_skipped')
+            return primary.result()
+
+        self._count('hedges')
+        logger.debug(f"{self.model} call exceeded p{self.hedge_percentile} "
+                     f"({delay:.2f}s), sending hedged request")
+        hedge = _get_hedge_executor().submit(contextvars.copy_context().run, self._timed, attempt)
+        hedge.add_done_callback(lambda _: _hedge_slots.release())
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._count('hedge_wins')
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def _ahedged(self, attempt: Callable[[], Awaitable[T]]) -> T:
+        async def timed():
+            start = time.monotonic()
+            result = await attempt()
+            self.latencies.observe(time.monotonic() - start)
+            return result
+
+        delay = self.hedge_delay()
+        if delay is None:
+            return await timed()
+
+        primary = asyncio.ensure_future(timed())
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        self._count('hedges')
+        hedge = asyncio.ensure_future(timed())
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._count('hedge_wins')
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _count(self, stat: str):
+        with self._lock:
+            self.stats[stat] += 1
+
+
+_model_settings: Dict[str, Dict] = {}
+_resilience: Dict[str, ModelResilience] = {}
+_resilience_lock = threading.Lock()
+
+
+def configure_resilience(config: Dict):
+    """
+    Set per-model retry, hedging and circuit breaker settings
+
+    Args:
+        config: Mapping of model name (or ``default``) to a dict with any
+            of the keys of DEFAULT_RESILIENCE
+    """
+    with _resilience_lock:
+        _model_settings.clear()
+        for model, settings in (config or {}).items():
+            _model_settings[model] = dict(settings)
+        _resilience.clear()
+
+
+def settings_for(model: str) -> Dict:
+    settings = dict(DEFAULT_RESILIENCE)
+    settings.update(_model_settings.get('default', {}))
+    settings.update(_model_settings.get(model, {}))
+    return settings
+
+
+def get_model_resilience(model: str) -> ModelResilience:
+    """Retry / hedge / breaker state shared by every agent that calls ``model``"""
+    with _resilience_lock:
+        if model not in _resilience:
+            _resilience[model] = ModelResilience(model, **settings_for(model))
+        return _resilience[model]
@@ -0,0 +1,193 @@
+"""
+Per-call LLM telemetry
+Records latency, token usage and errors of every agent LLM call,
+labelled by agent, model and debate round, and renders them in the
+Prometheus text exposition format
+"""
+
+import bisect
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, Optional, Tuple
+
+from loguru import logger
+
+# Debate round of the current thread / task (0 outside the debate)
+current_debate_round: ContextVar[int] = ContextVar('current_debate_round', default=0)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192)
+
+
+@contextmanager
+def debate_round(round_num: int):
+    """Label every LLM call made inside the block with ``round_num``"""
+    token = current_debate_round.set(round_num)
+    try:
+        yield round_num
+    finally:
+        current_debate_round.reset(token)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], **extra) -> str:
+    pairs = list(zip(names, values)) + list(extra.items())
+    if not pairs:
+        return ''
+    body = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                         .replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + body + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter per label set"""
+
+    type_name = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts (last slot is +Inf), sum, count
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels) -> int:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            return series[2] if series else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, [list(s[0]), s[1], s[2]]) for key, s in self._series.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                yield (f"{self.name}_bucket",
+                       _format_labels(self.labelnames, key, le=_format_value(bound)),
+                       cumulative)
+            yield f"{self.name}_sum", _format_labels(self.labelnames, key), total
+            yield f"{self.name}_count", _format_labels(self.labelnames, key), count
+
+
+class LLMMetrics:
+    """
+    Metrics for agent LLM calls
+
+    Latency and token histograms are labelled by agent, model and debate
+    round; the call counter additionally carries the outcome and the
+    error class of failed calls.
+    """
+
+    LABELS = ('agent', 'model', 'round')
+
+    def __init__(self):
+        self.latency = Histogram('medidoc_llm_request_duration_seconds',
+                                 'LLM call latency in seconds', self.LABELS)
+        self.prompt_tokens = Histogram('medidoc_llm_prompt_tokens',
+                                       'Prompt tokens per LLM call', self.LABELS,
+                                       buckets=TOKEN_BUCKETS)
+        self.completion_tokens = Histogram('medidoc_llm_completion_tokens',
+                                           'Completion tokens per LLM call', self.LABELS,
+                                           buckets=TOKEN_BUCKETS)
+        self.calls = Counter('medidoc_llm_requests_total', 'LLM calls by outcome',
+                             self.LABELS + ('outcome', 'error'))
+        self.cache_hits = Counter('medidoc_llm_cache_hits_total',
+                                  'LLM calls served from the response cache',
+                                  ('agent', 'model'))
+
+    def metrics(self):
+        return [self.latency, self.prompt_tokens, self.completion_tokens,
+                self.calls, self.cache_hits]
+
+    def record_call(self, agent: str, model: str, latency: float,
+                    prompt_tokens: int = 0, completion_tokens: int = 0,
+                    error: Optional[BaseException] = None):
+        """Record one completed (or failed) LLM call"""
+        labels = {'agent': agent, 'model': model, 'round': current_debate_round.get()}
+        error_class = type(error).__name__ if error is not None else ''
+
+        self.latency.observe(latency, **labels)
+        self.calls.inc(outcome='error' if error is not None else 'ok',
+                       error=error_class, **labels)
+        if error is None:
+            self.prompt_tokens.observe(prompt_tokens, **labels)
+            self.completion_tokens.observe(completion_tokens, **labels)
+
+        logger.debug(f"LLM call agent={agent} model={model} round={labels['round']} "
+                     f"latency={latency:.3f}s prompt_tokens={prompt_tokens} "
+                     f"completion_tokens={completion_tokens} error={error_class or '-'}")
+
+    def record_cache_hit(self, agent: str, model: str):
+        self.cache_hits.inc(agent=agent, model=model)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (0.0.4)"""
+        lines = []
+        for metric in self.metrics():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+_default_metrics = LLMMetrics()
+
+
+def get_default_metrics() -> LLMMetrics:
+    """Process-wide metrics shared by agents that were not given their own"""
+    return _default_metrics
@@ -6,6 +6,8 @@ Routes cases between edge and cloud based on complexity
 from typing import Dict, Optional
 from loguru import logger
 
+from src.agents.records import record_text
+
 
 class HybridDeployment:
     """
@@ -60,7 +62,7 @@ class HybridDeployment:
     def _assess_complexity(self, case: Dict) -> float:
         """Assess case complexity score"""
         score = 0.0
-        text = str(case).lower()
+        text = record_text(case)
         
         # Complexity factors
         factors = {
@@ -4,6 +4,8 @@ from typing import Dict, Optional
 from loguru import logger
 import json
 
+from src.agents.records import record_text
+
 
 class EdgeDevice:
     
@@ -130,7 +132,7 @@ class EdgeDevice:
     
     def _assess_complexity(self, data: Dict) -> float:
         score = 0.0
-        text = str(data).lower()
+        text = record_text(data)
         
         if 'multiple' in text or 'complications' in text:
             score += 0.3
@@ -0,0 +1,209 @@
+"""
+Content-addressed cache for OCR results
+In-memory LRU tier backed by an optional on-disk tier with a size cap,
+keyed on the input file's content hash and the OCR configuration
+"""
+
+import hashlib
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from loguru import logger
+
+# Bump when the cached representation or OCR pipeline output changes
+CACHE_VERSION = 1
+
+# Config keys that change OCR output: models, the engine's numeric path
+# (GPU, MKL-DNN via cpu_threads or worker processes, recognition batch
+# padding), rasterization and preprocessing
+OCR_CONFIG_KEYS = ('lang', 'det_model_dir', 'rec_model_dir', 'use_gpu', 'cpu_threads',
+                   'workers', 'worker_threads', 'rec_batch_num', 'pdf_dpi', 'preprocessing')
+
+# A page is a list of (box, text, confidence) lines
+Line = Tuple[List, str, float]
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    """SHA-256 of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def encode_pages(pages: List[List[Line]]) -> bytes:
+    """Compact form: per page the texts, confidences (4 decimals) and integer box coordinates"""
+    payload = [
+        [[text for _, text, _ in lines],
+         [round(float(confidence), 4) for _, _, confidence in lines],
+         [int(round(float(value))) for box, _, _ in lines for point in box for value in point]]
+        for lines in pages
+    ]
+    return zlib.compress(json.dumps(payload, ensure_ascii=False,
+                                    separators=(',', ':')).encode('utf-8'))
+
+
+def decode_pages(data: bytes) -> List[List[Line]]:
+    pages = []
+    for texts, confidences, coords in json.loads(zlib.decompress(data)):
+        boxes = [[coords[i:i + 2] for i in range(start, start + 8, 2)]
+                 for start in range(0, len(coords), 8)]
+        pages.append(list(zip(boxes, texts, confidences)))
+    return pages
+
+
+class OCRResultCache:
+    """
+    Two-tier cache of per-page OCR lines keyed by content and config
+
+    The memory tier holds at most ``max_entries`` documents and evicts
+    the least recently used one first. The disk tier stores compressed
+    entries and, once it exceeds ``max_disk_bytes``, deletes the least
+    recently used files until it is back under 90% of the cap.
+    """
+
+    def __init__(self, max_entries: int = 256, disk_dir: Optional[str] = None,
+                 max_disk_bytes: int = 512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evicted': 0}
+        self._entries = OrderedDict()
+        self._disk_index = OrderedDict()  # key -> size, least recently used first
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._scan_disk()
+
+    @classmethod
+    def from_config(cls, config: Dict) -> 'OCRResultCache':
+        return cls(
+            max_entries=config.get('max_entries', 256),
+            disk_dir=config.get('disk_dir'),
+            max_disk_bytes=int(config.get('max_disk_mb', 512) * 1024 * 1024)
+        )
+
+    @staticmethod
+    def make_key(content_hash: str, ocr_config: Dict, keys: Iterable[str] = OCR_CONFIG_KEYS) -> str:
+        settings = {key: ocr_config.get(key) for key in keys}
+        payload = json.dumps([CACHE_VERSION, content_hash, settings], sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[List[List[Line]]]:
+        with self._lock:
+            pages = self._entries.get(key)
+            if pages is not None:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return pages
+
+        pages = self._disk_get(key)
+        with self._lock:
+            if pages is None:
+                self.stats['misses'] += 1
+                return None
+            self.stats['disk_hits'] += 1
+        self._memory_set(key, pages)
+        return pages
+
+    def set(self, key: str, pages: List[List[Line]]):
+        self._memory_set(key, pages)
+        self._disk_set(key, pages)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def disk_usage(self) -> int:
+        return self._disk_bytes
+
+    def _memory_set(self, key: str, pages: List[List[Line]]):
+        with self._lock:
+            self._entries[key] = pages
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.ocr")
+
+    def _scan_disk(self):
+        entries = []
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if name.endswith('.ocr'):
+                    stat = os.stat(os.path.join(root, name))
+                    entries.append((stat.st_mtime, name[:-len('.ocr')], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk_index[key] = size
+            self._disk_bytes += size
+
+    def _disk_get(self, key: str) -> Optional[List[List[Line]]]:
+        if not self.disk_dir:
+            return None
+
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                pages = decode_pages(f.read())
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, zlib.error) as e:
+            logger.warning(f"Unreadable OCR cache entry {path}: {e}")
+            return None
+
+        with self._lock:
+            if key in self._disk_index:
+                self._disk_index.move_to_end(key)
+        return pages
+
+    def _disk_set(self, key: str, pages: List[List[Line]]):
+        if not self.disk_dir:
+            return
+
+        data = encode_pages(pages)
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to persist OCR cache entry {key}: {e}")
+            return
+
+        with self._lock:
+            self._disk_bytes += len(data) - self._disk_index.pop(key, 0)
+            self._disk_index[key] = len(data)
+            evicted = self._evict_disk()
+
+        for old_key in evicted:
+            try:
+                os.remove(self._disk_path(old_key))
+            except OSError:
+                pass
+
+    def _evict_disk(self) -> List[str]:
+        if self._disk_bytes <= self.max_disk_bytes:
+            return []
+
+        evicted = []
+        target = self.max_disk_bytes * 0.9
+        while self._disk_index and self._disk_bytes > target:
+            old_key, size = self._disk_index.popitem(last=False)
+            self._disk_bytes -= size
+            evicted.append(old_key)
+            self.stats['evicted'] += 1
+        return evicted
@@ -1,27 +1,171 @@
+import multiprocessing
 import os
-from typing import Dict, List, Optional
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 from paddleocr import PaddleOCR
 from loguru import logger
 import cv2
 import numpy as np
+import pymupdf
+
+from .cache import OCRResultCache, file_digest
+from .preprocessing import ImagePreprocessor
+
+# PDF user space is 72 points per inch
+PDF_POINTS_PER_INCH = 72
+
+
+def create_ocr_engine(config: Dict) -> PaddleOCR:
+    """PaddleOCR configured from the ``ocr`` config section"""
+    options = {
+        'use_angle_cls': True,
+        'lang': config.get('lang', 'ch'),
+        'use_gpu': config.get('use_gpu', True),
+        'show_log': False
+    }
+    if config.get('cpu_threads'):
+        # Paddle only applies the CPU thread count with MKL-DNN enabled.
+        # MKL-DNN kernels round differently from the default CPU ones, so
+        # pool workers (which always set cpu_threads) can return slightly
+        # different confidences, and rarely text, than in-process OCR
+        # without ``ocr.cpu_threads``
+        options.update(enable_mkldnn=True, cpu_threads=config['cpu_threads'])
+    if config.get('rec_batch_num'):
+        options['rec_batch_num'] = config['rec_batch_num']
+    return PaddleOCR(**options)
+
+
+def sort_boxes(boxes: List) -> List[np.ndarray]:
+    """
+    Text boxes in reading order: top to bottom, then left to right for
+    boxes whose tops are within 10 px (PaddleOCR's line ordering)
+    """
+    ordered = sorted((np.asarray(box, dtype=np.float32) for box in boxes),
+                     key=lambda box: (box[0][1], box[0][0]))
+    for i in range(len(ordered) - 1):
+        for j in range(i, -1, -1):
+            if (abs(ordered[j + 1][0][1] - ordered[j][0][1]) < 10
+                    and ordered[j + 1][0][0] < ordered[j][0][0]):
+                ordered[j], ordered[j + 1] = ordered[j + 1], ordered[j]
+            else:
+                break
+    return ordered
+
+
+def crop_text_line(image: np.ndarray, box: np.ndarray) -> np.ndarray:
+    """Perspective-correct crop of one quadrilateral text box"""
+    width = int(max(np.linalg.norm(box[0] - box[1]), np.linalg.norm(box[2] - box[3])))
+    height = int(max(np.linalg.norm(box[0] - box[3]), np.linalg.norm(box[1] - box[2])))
+    target = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    crop = cv2.warpPerspective(
+        image,
+        cv2.getPerspectiveTransform(box, target),
+        (width, height),
+        borderMode=cv2.BORDER_REPLICATE,
+        flags=cv2.INTER_CUBIC
+    )
+    # Vertical text lines are recognized rotated
+    if crop.shape[0] >= 1.5 * crop.shape[1]:
+        crop = np.rot90(crop)
+    return crop
+
+
+def rasterize_page(page: pymupdf.Page, dpi: int) -> np.ndarray:
+    """Render one PDF page to a BGR ``np.ndarray`` (like ``cv2.imread``)"""
+    zoom = dpi / PDF_POINTS_PER_INCH
+    pixmap = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom),
+                             colorspace=pymupdf.csRGB, alpha=False)
+    rgb = np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(
+        pixmap.height, pixmap.width, pixmap.n
+    )
+    # cvtColor copies, so the pixmap can be released right away
+    return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+
+
+# OCR engine and preprocessing of the current pool worker process
+_worker_ocr = None
+_worker_preprocessor = None
+
+
+def _init_ocr_worker(engine_factory: Callable[[Dict], PaddleOCR], config: Dict,
+                     threads: int):
+    """
+    Pool initializer: limit threads, then build and warm this worker's engine
+    
+    Paddle is already imported (with this module) by the time this runs,
+    so its thread pools are sized through ``cpu_threads``, not through
+    OMP_NUM_THREADS and friends.
+    """
+    global _worker_ocr, _worker_preprocessor
+    cv2.setNumThreads(threads)
+    
+    _worker_preprocessor = ImagePreprocessor(config.get('preprocessing'))
+    _worker_ocr = engine_factory(dict(config, cpu_threads=threads))
+    # The first inference initializes the predictors
+    _worker_ocr.ocr(np.full((32, 128, 3), 255, dtype=np.uint8), cls=True)
+
+
+def _ocr_pdf_page(pdf_path: str, page_number: int, dpi: int) -> List:
+    """Rasterize and OCR one page inside a pool worker"""
+    with pymupdf.open(pdf_path) as document:
+        image = rasterize_page(document[page_number], dpi)
+    return _worker_ocr.ocr(_worker_preprocessor(image), cls=True)
 
 
 class MedicalDocumentProcessor:
     
     def __init__(self, config: Dict):
         self.config = config
-        self.ocr = PaddleOCR(
-            use_angle_cls=True,
-            lang=config.get('lang', 'ch'),
-            use_gpu=config.get('use_gpu', True),
-            show_log=False
-        )
+        self.pdf_dpi = config.get('pdf_dpi', 200)
+        # Built on first use, so PDF rasterization and text structuring
+        # do not pay for loading the OCR models
+        self.engine_factory = create_ocr_engine
+        self._ocr = None
+        
+        # Page-parallel PDF OCR in worker processes (0 or 1: in-process)
+        self.ocr_workers = config.get('workers', 0)
+        self.worker_threads = config.get('worker_threads', 1)
+        self._pool = None
+        
+        # process_images(): decode threads and images per recognition batch
+        self.decode_workers = config.get('decode_workers', 4)
+        self.image_batch_size = config.get('image_batch_size', 16)
+        
+        # Downscale / binarize / deskew / crop before detection
+        self.preprocessor = ImagePreprocessor(config.get('preprocessing'))
+        
+        # Results of previously seen files, by content hash and OCR config
+        cache_config = config.get('cache', {})
+        self.cache = None
+        if cache_config.get('enabled', False):
+            self.cache = OCRResultCache.from_config(cache_config)
         logger.info("MedicalDocumentProcessor initialized")
     
+    @property
+    def ocr(self) -> PaddleOCR:
+        if self._ocr is None:
+            self._ocr = self.engine_factory(self.config)
+        return self._ocr
+    
+    def close(self):
+        """Stop the OCR worker processes, if any"""
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+    
     def process_pdf(self, pdf_path: str) -> Dict:
         logger.info(f"Processing PDF: {pdf_path}")
         
-        images = self._pdf_to_images(pdf_path)
+        key = self._cache_key(pdf_path)
+        pages = self.cache.get(key) if key else None
+        if pages is None:
+            pages = []
+            for idx, ocr_result in enumerate(self._ocr_pages(pdf_path)):
+                logger.debug(f"Processed page {idx + 1}")
+                pages.append(self._page_lines(ocr_result))
+            if key:
+                self.cache.set(key, pages)
         
         results = {
             'raw_text': '',
@@ -33,17 +177,8 @@ class MedicalDocumentProcessor:
         total_confidence = 0
         text_blocks = []
         
-        for idx, image in enumerate(images):
-            logger.debug(f"Processing page {idx + 1}/{len(images)}")
-            
-            ocr_result = self.ocr.ocr(image, cls=True)
-            
-            if not ocr_result or not ocr_result[0]:
-                continue
-            
-            for line in ocr_result[0]:
-                text = line[1][0]
-                confidence = line[1][1]
+        for lines in pages:
+            for _, text, confidence in lines:
                 text_blocks.append(text)
                 total_confidence += confidence
         
@@ -57,20 +192,131 @@ class MedicalDocumentProcessor:
     def process_image(self, image_path: str) -> Dict:
         logger.info(f"Processing image: {image_path}")
         
-        image = cv2.imread(image_path)
-        ocr_result = self.ocr.ocr(image, cls=True)
+        key = self._cache_key(image_path)
+        pages = self.cache.get(key) if key else None
+        if pages is None:
+            image = self.preprocessor(cv2.imread(image_path))
+            pages = [self._page_lines(self.ocr.ocr(image, cls=True))]
+            if key:
+                self.cache.set(key, pages)
         
-        text_blocks = []
-        confidences = []
+        return self._image_result(pages[0])
+    
+    def process_images(self, image_paths: List[str]) -> List[Dict]:
+        """
+        OCR many images with batched recognition
         
-        if ocr_result and ocr_result[0]:
-            for line in ocr_result[0]:
-                text = line[1][0]
-                confidence = line[1][1]
-                text_blocks.append(text)
-                confidences.append(confidence)
+        Images are decoded and preprocessed (or found in the result
+        cache) on ``decode_workers`` threads while earlier ones go
+        through text detection, with at most ``image_batch_size +
+        decode_workers`` images submitted or held at a time. The
+        text-line crops of up to ``image_batch_size`` images are then
+        classified and recognized as one batch and the results split
+        back per image. Each result has the same form as
+        process_image()'s and is equivalent to it up to batch padding:
+        PaddleOCR pads the crops of a recognition batch to a shared
+        width, so a line batched with other images' lines can come out
+        with a slightly different confidence or, rarely, text.
+        
+        Returns:
+            One result per path, in order; unreadable files get an
+            ``error`` and empty text
+        """
+        logger.info(f"Processing {len(image_paths)} images")
+        results = []
+        
+        # Keep one decode per thread running ahead of the batch being
+        # filled, so at most image_batch_size + decode_workers are held
+        with ThreadPoolExecutor(max_workers=self.decode_workers,
+                                thread_name_prefix='medidoc-decode') as decoder:
+            in_flight = deque()
+            batch = []
+            for path in image_paths:
+                in_flight.append((path, decoder.submit(self._load_image, path)))
+                if len(in_flight) > self.decode_workers:
+                    loaded_path, future = in_flight.popleft()
+                    batch.append((loaded_path, *future.result()))
+                if len(batch) >= self.image_batch_size:
+                    results.extend(self._recognize_batch(batch))
+                    batch = []
+            while in_flight:
+                loaded_path, future = in_flight.popleft()
+                batch.append((loaded_path, *future.result()))
+                if len(batch) >= self.image_batch_size:
+                    results.extend(self._recognize_batch(batch))
+                    batch = []
+            if batch:
+                results.extend(self._recognize_batch(batch))
+        
+        return results
+    
+    def _load_image(self, image_path: str) -> Tuple[Optional[str], Optional[List], Optional[np.ndarray]]:
+        """(cache key, cached pages, decoded image); the image is only read on a miss"""
+        key = self._cache_key(image_path)
+        pages = self.cache.get(key) if key else None
+        if pages is not None:
+            return key, pages, None
+        return key, None, self.preprocessor(cv2.imread(image_path))
+    
+    def _recognize_batch(self, batch: List[Tuple]) -> List[Dict]:
+        """
+        Detect per image, then recognize every image's crops in one call
+        
+        Results can differ slightly from per-image OCR because the crops
+        are padded to the width of the widest one in each batch.
+        """
+        crops = []
+        boxes_by_image = []
+        for path, key, pages, image in batch:
+            boxes = []
+            if pages is None and image is not None:
+                detected = self.ocr.ocr(image, det=True, rec=False, cls=False)
+                boxes = sort_boxes(detected[0]) if detected and detected[0] else []
+                crops.extend(crop_text_line(image, box) for box in boxes)
+            boxes_by_image.append(boxes)
+        
+        recognized = iter(self.ocr.ocr([crops], det=False, rec=True, cls=True)[0] if crops else [])
+        # Same low-score filter PaddleOCR applies to full det+rec results
+        drop_score = getattr(self.ocr, 'drop_score', 0.5)
         
-        raw_text = '\n'.join(text_blocks)
+        results = []
+        for (path, key, pages, image), boxes in zip(batch, boxes_by_image):
+            if pages is None and image is None:
+                logger.error(f"Could not read image: {path}")
+                result = self._image_result([])
+                result['error'] = 'could not read image'
+                results.append(result)
+                continue
+            
+            if pages is None:
+                lines = [(box.tolist(), text, confidence)
+                         for box, (text, confidence) in zip(boxes, recognized)]
+                pages = [[line for line in lines if line[2] >= drop_score]]
+                if key:
+                    self.cache.set(key, pages)
+            results.append(self._image_result(pages[0]))
+        return results
+    
+    def _cache_key(self, path: str) -> Optional[str]:
+        """Result cache key of a file, None when caching is off or it cannot be read"""
+        if self.cache is None:
+            return None
+        try:
+            return OCRResultCache.make_key(file_digest(path), self.config)
+        except OSError:
+            return None
+    
+    @staticmethod
+    def _page_lines(ocr_result: List) -> List[Tuple[List, str, float]]:
+        """(box, text, confidence) lines of a single-image PaddleOCR result"""
+        if not ocr_result or not ocr_result[0]:
+            return []
+        return [(line[0], line[1][0], line[1][1]) for line in ocr_result[0]]
+    
+    def _image_result(self, lines: List[Tuple[List, str, float]]) -> Dict:
+        """Result dict of one image from its (box, text, confidence) lines"""
+        raw_text = '\n'.join(text for _, text, _ in lines)
+        confidences = [confidence for _, _, confidence in lines]
         avg_confidence = sum(confidences) / len(confidences) if confidences else 0
         
         return {
@@ -79,9 +325,58 @@ class MedicalDocumentProcessor:
             'confidence': avg_confidence
         }
     
-    def _pdf_to_images(self, pdf_path: str) -> List[np.ndarray]:
-        logger.warning("PDF to image conversion not implemented")
-        return []
+    def _ocr_pages(self, pdf_path: str) -> Iterator[List]:
+        """
+        PaddleOCR result of every page, in page order
+        
+        With ``workers`` > 1, pages are rasterized and recognized in the
+        worker processes, at most two per worker in flight, and yielded
+        in order as they complete; otherwise pages are OCRed in-process
+        as they are rasterized.
+        """
+        if self.ocr_workers <= 1:
+            for image in self._pdf_to_images(pdf_path):
+                yield self.ocr.ocr(self.preprocessor(image), cls=True)
+            return
+        
+        with pymupdf.open(pdf_path) as document:
+            page_count = document.page_count
+        
+        pool = self._get_pool()
+        in_flight = deque()
+        for page_number in range(page_count):
+            in_flight.append(pool.submit(_ocr_pdf_page, pdf_path, page_number, self.pdf_dpi))
+            if len(in_flight) >= 2 * self.ocr_workers:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+    
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            logger.info(f"Starting {self.ocr_workers} OCR workers "
+                        f"({self.worker_threads} threads each)")
+            # Paddle is not fork-safe; spawned workers build their own engine
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.ocr_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_ocr_worker,
+                initargs=(self.engine_factory, self.config, self.worker_threads)
+            )
+        return self._pool
+    
+    def _pdf_to_images(self, pdf_path: str, dpi: Optional[int] = None) -> Iterator[np.ndarray]:
+        """
+        Rasterize a PDF page by page
+        
+        Yields each page as a BGR ``np.ndarray`` (like ``cv2.imread``) at
+        ``dpi`` (default ``pdf_dpi``). Only the current page is held in
+        memory, so long documents cost no more than a single page.
+        """
+        dpi = dpi or self.pdf_dpi
+        with pymupdf.open(pdf_path) as document:
+            logger.debug(f"Rasterizing {document.page_count} pages at {dpi} dpi")
+            for page in document:
+                yield rasterize_page(page, dpi)
     
     def _structure_medical_text(self, text: str) -> Dict:
         structured = {
@@ -0,0 +1,166 @@
+"""
+Image preprocessing before OCR
+Downscaling, deskewing, margin cropping and grayscale / binarization,
+each a whole-array NumPy / OpenCV operation, so detection runs on
+smaller, straighter images
+"""
+
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+DEFAULT_PREPROCESSING = {
+    'enabled': False,
+    'max_side': None,      # px; downscale so the long side fits
+    'target_dpi': None,    # downscale from source_dpi to this resolution
+    'source_dpi': 300,     # assumed resolution of images without a DPI
+    'color': 'color',      # 'color', 'gray' or 'binarize'
+    'deskew': False,
+    'max_skew': 15.0,      # degrees; larger estimates are ignored
+    'crop_margins': False,
+    'margin': 16           # px kept around the content
+}
+
+
+def to_gray(image: np.ndarray) -> np.ndarray:
+    return image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def ink_mask(gray: np.ndarray) -> np.ndarray:
+    """Boolean mask of dark (text) pixels by Otsu's threshold"""
+    _, mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    return mask.astype(bool)
+
+
+def downscale(image: np.ndarray, max_side: Optional[int] = None,
+              scale: Optional[float] = None) -> np.ndarray:
+    """Shrink (never enlarge) to ``max_side`` px on the long side and / or by ``scale``"""
+    factor = 1.0
+    if max_side:
+        factor = min(factor, max_side / max(image.shape[:2]))
+    if scale:
+        factor = min(factor, scale)
+    if factor >= 1.0:
+        return image
+
+    height, width = image.shape[:2]
+    size = (max(1, round(width * factor)), max(1, round(height * factor)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def binarize(image: np.ndarray) -> np.ndarray:
+    """Black text on white, by Otsu's threshold"""
+    _, binary = cv2.threshold(to_gray(image), 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    return binary
+
+
+def estimate_skew(image: np.ndarray, sample_side: int = 1024) -> float:
+    """
+    Text skew in degrees (positive: counter-clockwise)
+
+    Fits the minimum-area rectangle around the text pixels; 0.0 when
+    the page has no text. Estimated on a copy at most ``sample_side`` px
+    on the long side, since uniform scaling keeps the angle.
+    """
+    gray = downscale(to_gray(image), sample_side)
+    points = cv2.findNonZero(ink_mask(gray).view(np.uint8))
+    if points is None or len(points) < 2:
+        return 0.0
+
+    (_, _), (width, height), angle = cv2.minAreaRect(points)
+    # OpenCV reports the angle of one rectangle side in [-90, 90]; fold
+    # it to the smallest rotation that makes the long side horizontal
+    if width < height:
+        angle -= 90
+    angle = (angle + 90) % 180 - 90
+    return -angle
+
+
+def rotate(image: np.ndarray, angle: float) -> np.ndarray:
+    """Rotate counter-clockwise by ``angle`` degrees about the centre, same size"""
+    height, width = image.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    return cv2.warpAffine(image, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                          borderMode=cv2.BORDER_REPLICATE)
+
+
+def deskew(image: np.ndarray, max_skew: float = 15.0) -> np.ndarray:
+    angle = estimate_skew(image)
+    if abs(angle) < 0.1 or abs(angle) > max_skew:
+        return image
+    return rotate(image, -angle)
+
+
+def crop_margins(image: np.ndarray, margin: int = 16) -> np.ndarray:
+    """Crop to the bounding box of the text pixels plus ``margin`` px"""
+    mask = ink_mask(to_gray(image))
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if not len(rows):
+        return image
+
+    top = max(0, rows[0] - margin)
+    bottom = min(image.shape[0], rows[-1] + margin + 1)
+    left = max(0, cols[0] - margin)
+    right = min(image.shape[1], cols[-1] + margin + 1)
+    return image[top:bottom, left:right]
+
+
+class ImagePreprocessor:
+    """
+    Configured preprocessing pipeline
+
+    Steps run in a fixed order: downscale, deskew, crop_margins, then
+    color (gray / binarize) last so rotation does not blur the
+    thresholded image. The output is always 3-channel BGR, which is
+    what PaddleOCR's detector and recognizer expect.
+
+    Args:
+        config: The ``ocr.preprocessing`` section, see DEFAULT_PREPROCESSING
+    """
+
+    def __init__(self, config: Optional[Dict] = None):
+        self.settings = dict(DEFAULT_PREPROCESSING)
+        self.settings.update(config or {})
+        self.enabled = self.settings['enabled']
+
+    def steps(self) -> List[Tuple[str, Callable[[np.ndarray], np.ndarray]]]:
+        """(name, function) of every active step, in order"""
+        s = self.settings
+        steps = []
+
+        scale = s['target_dpi'] / s['source_dpi'] if s['target_dpi'] else None
+        if s['max_side'] or scale:
+            steps.append(('downscale', lambda image: downscale(image, s['max_side'], scale)))
+        if s['deskew']:
+            steps.append(('deskew', lambda image: deskew(image, s['max_skew'])))
+        if s['crop_margins']:
+            steps.append(('crop_margins', lambda image: crop_margins(image, s['margin'])))
+        if s['color'] == 'gray':
+            steps.append(('gray', to_gray))
+        elif s['color'] == 'binarize':
+            steps.append(('binarize', binarize))
+        return steps
+
+    def __call__(self, image: np.ndarray, timings: Optional[Dict[str, float]] = None) -> np.ndarray:
+        """
+        Preprocess one image
+
+        Args:
+            image: BGR or grayscale image
+            timings: If given, seconds spent per step are added to it
+        """
+        if not self.enabled or image is None:
+            return image
+
+        for name, step in self.steps():
+            start = time.perf_counter()
+            image = step(image)
+            if timings is not None:
+                timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        return image
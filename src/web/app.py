@@ -1,7 +1,10 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
 from flask_cors import CORS
 from loguru import logger
+import json
 import os
+import threading
+import yaml
 
 app = Flask(__name__)
 CORS(app)
@@ -11,6 +14,36 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 
+CONFIG_PATH = os.environ.get('MEDIDOC_CONFIG', 'config/config.yaml')
+
+_diagnostic_system = None
+_diagnostic_system_lock = threading.Lock()
+
+
+def load_config(config_path: str = CONFIG_PATH) -> dict:
+    with open(config_path, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f)
+
+
+def get_diagnostic_system():
+    """Shared MultiAgentDiagnosticSystem, created on first use"""
+    global _diagnostic_system
+    if _diagnostic_system is None:
+        with _diagnostic_system_lock:
+            if _diagnostic_system is None:
+                from src.agents.diagnostic_system import MultiAgentDiagnosticSystem
+                _diagnostic_system = MultiAgentDiagnosticSystem(
+                    load_config().get('agents', {})
+                )
+    return _diagnostic_system
+
+
+def _json_default(value):
+    """Render lazy report versions; fall back to str() for the rest"""
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+    return str(value)
+
 
 @app.route('/')
 def index():
@@ -52,6 +85,57 @@ def diagnose():
     })
 
 
+@app.route('/api/diagnose/stream', methods=['POST'])
+def diagnose_stream():
+    """Stream diagnosis progress as server-sent events"""
+    data = request.get_json(silent=True) or {}
+    document = {'raw_text': data.get('document', '')}
+    
+    events = get_diagnostic_system().diagnose_stream(
+        document, case_id=data.get('case_id')
+    )
+    
+    def sse():
+        for event in events:
+            payload = json.dumps(event, ensure_ascii=False, default=_json_default)
+            yield f"event: {event['event']}\ndata: {payload}\n\n"
+    
+    return Response(
+        stream_with_context(sse()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.route('/api/diagnose/report', methods=['POST'])
+def diagnose_report():
+    """Diagnose a document and stream one report version as Markdown"""
+    from src.agents.diagnostic_system import MultiAgentDiagnosticSystem
+    data = request.get_json(silent=True) or {}
+    version = data.get('version', 'professional')
+    # Reject before paying for a full multi-agent run
+    if version not in MultiAgentDiagnosticSystem.REPORT_VERSIONS:
+        return jsonify({'error': f'Unknown report version: {version}'}), 400
+    
+    system = get_diagnostic_system()
+    report = system.diagnose({'raw_text': data.get('document', '')},
+                             case_id=data.get('case_id'))
+    
+    return Response(
+        stream_with_context(report['report_versions'].stream(version)),
+        mimetype='text/markdown',
+        headers={'X-Case-Id': report['metadata']['case_id']}
+    )
+
+
+@app.route('/metrics')
+def metrics():
+    """Agent LLM call metrics in the Prometheus text format"""
+    from src.agents.telemetry import get_default_metrics
+    return Response(get_default_metrics().render(),
+                    mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
 @app.route('/api/status')
 def status():
     return jsonify({
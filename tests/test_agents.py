@@ -2,8 +2,14 @@
 Unit tests for multi-agent system
 """
 
+import asyncio
+import itertools
+import time
+
 import pytest
 from src.agents.base_agent import DocumentAnalyzerAgent, CardiologyAgent
+from src.agents.diagnostic_system import MultiAgentDiagnosticSystem
+from src.agents.llm_backend import LocalBackend
 
 
 def test_document_analyzer_init():
@@ -28,5 +34,776 @@ def test_system_prompt():
     assert "medical" in prompt.lower()
 
 
+def test_parallel_consultation_tracks_slowest_specialist():
+    """Test specialists are consulted concurrently"""
+    system = MultiAgentDiagnosticSystem({'agent_timeout': 5})
+    for agent in system.specialists.values():
+        agent.analyze = lambda data, a=agent, **kw: time.sleep(0.2) or {'summary': a.specialty}
+    
+    start = time.monotonic()
+    opinions, failures = system._consult_specialists(
+        {}, ['cardiology', 'oncology', 'radiology']
+    )
+    elapsed = time.monotonic() - start
+    
+    assert list(opinions) == ['cardiology', 'oncology', 'radiology']
+    assert failures == {}
+    assert elapsed < 0.5
+    system.shutdown()
+
+
+def test_parallel_consultation_partial_results():
+    """Test failed and timed-out specialists do not sink the case"""
+    system = MultiAgentDiagnosticSystem({'agent_timeout': 0.2})
+    system.specialists['cardiology'].analyze = lambda data, **kw: {'summary': 'ok'}
+    system.specialists['oncology'].analyze = lambda data, **kw: {'error': 'upstream 500'}
+    system.specialists['radiology'].analyze = lambda data, **kw: time.sleep(1) or {}
+    
+    opinions, failures = system._consult_specialists(
+        {}, ['cardiology', 'oncology', 'radiology']
+    )
+    
+    assert list(opinions) == ['cardiology']
+    assert failures['oncology'] == 'upstream 500'
+    assert 'timed out' in failures['radiology']
+    system.shutdown()
+
+
+def test_agent_timeout_excludes_time_queued_on_shared_pool():
+    """Test calls waiting for a pool worker are not timed out"""
+    from concurrent.futures import ThreadPoolExecutor
+    
+    system = MultiAgentDiagnosticSystem({'agent_timeout': 0.5, 'agent_workers': 2})
+    
+    def slow():
+        time.sleep(0.3)
+        return {'summary': 'ok'}
+    
+    def slow_stream():
+        time.sleep(0.3)
+        yield {'event': 'result', 'result': {'summary': 'ok'}}
+    
+    with ThreadPoolExecutor(max_workers=2) as cases:
+        fanned = [cases.submit(system._fan_out, {'a': slow, 'b': slow}, 'consultation')
+                  for _ in range(2)]
+        for future in fanned:
+            assert future.result() == {'a': {'summary': 'ok'}, 'b': {'summary': 'ok'}}
+        
+        streamed = [cases.submit(lambda: list(system._stream_fan_out(
+                        {'a': slow_stream, 'b': slow_stream}, 'consultation')))
+                    for _ in range(2)]
+        for future in streamed:
+            assert sorted(future.result()) == sorted(
+                [('a', {'event': 'result', 'result': {'summary': 'ok'}}),
+                 ('b', {'event': 'result', 'result': {'summary': 'ok'}})])
+    system.shutdown()
+
+
+def test_debate_round_revisions_run_concurrently():
+    """Test revisions within a round run in parallel and are timed"""
+    system = MultiAgentDiagnosticSystem({'max_debate_rounds': 2, 'agent_timeout': 5})
+    counter = itertools.count()
+    for name, agent in system.specialists.items():
+        agent.revise = lambda others, n=name, **kw: (
+            time.sleep(0.2) or {'summary': f"{n} draft {next(counter)}"}
+        )
+    
+    opinions = {name: {'summary': name} for name in system.specialists}
+    stats = {}
+    start = time.monotonic()
+    system._debate_and_consensus(opinions, stats)
+    elapsed = time.monotonic() - start
+    
+    assert len(stats['rounds']) == 2
+    assert all(r['revisions'] == 3 for r in stats['rounds'])
+    assert elapsed < 1.0
+    system.shutdown()
+
+
+def test_debate_stops_early_on_agreement():
+    """Test debate terminates once diagnoses converge"""
+    system = MultiAgentDiagnosticSystem({'max_debate_rounds': 3})
+    for agent in system.specialists.values():
+        agent.revise = lambda others, **kw: {'summary': 'agreed', 'diagnoses': ['Unstable angina']}
+    
+    opinions = {
+        'cardiology': {'summary': 'a', 'diagnoses': ['Unstable angina']},
+        'radiology': {'summary': 'b', 'diagnoses': ['Pulmonary nodule']}
+    }
+    stats = {}
+    system._debate_and_consensus(opinions, stats)
+    
+    assert stats['rounds_run'] == 1
+    assert stats['rounds_saved'] == 2
+    assert stats['calls_saved'] == 4
+    assert stats['termination'] == 'consensus'
+    system.shutdown()
+
+
+def test_debate_reuses_revisions_when_peers_unchanged():
+    """Test only specialists whose peers changed are re-queried"""
+    system = MultiAgentDiagnosticSystem({'max_debate_rounds': 3})
+    counter = itertools.count()
+    calls = {name: 0 for name in system.specialists}
+    
+    def revise(others, name, **kw):
+        calls[name] += 1
+        if name == 'cardiology':
+            return {'summary': f"cardiology draft {next(counter)}"}
+        return {'summary': f"{name} holds"}
+    
+    for name, agent in system.specialists.items():
+        agent.revise = lambda others, n=name, **kw: revise(others, n)
+    
+    opinions = {name: {'summary': f"{name} holds"} for name in system.specialists}
+    stats = {}
+    system._debate_and_consensus(opinions, stats)
+    
+    assert calls == {'cardiology': 1, 'oncology': 2, 'radiology': 2}
+    assert stats['rounds'][1]['revisions'] == 2
+    assert stats['rounds'][1]['reused'] == 1
+    assert stats['calls_reused'] == 1
+    system.shutdown()
+
+
+def test_agreement_score():
+    """Test agreement metric on summaries and diagnoses"""
+    from src.agents.consensus import agreement_score
+    
+    same = {'a': {'summary': '胸痛 chest pain'}, 'b': {'summary': '胸痛 chest pain'}}
+    different = {'a': {'summary': 'chest pain'}, 'b': {'summary': 'lung nodule'}}
+    assert agreement_score(same) == pytest.approx(1.0)
+    assert agreement_score(different) == 0.0
+    assert agreement_score({'a': {'diagnoses': ['X', 'Y']},
+                            'b': {'diagnoses': ['x']}}) == pytest.approx(0.5)
+
+
+def test_response_cache_lru_and_ttl(tmp_path):
+    """Test cache eviction, expiry and disk persistence"""
+    from src.agents.cache import ResponseCache
+    
+    cache = ResponseCache(max_entries=2, ttl=None, disk_dir=str(tmp_path))
+    cache.set('a', 'A')
+    cache.set('b', 'B')
+    cache.get('a')
+    cache.set('c', 'C')
+    assert len(cache) == 2
+    assert 'b' not in cache._entries
+    
+    # Evicted from memory but still on disk
+    restarted = ResponseCache(max_entries=2, ttl=None, disk_dir=str(tmp_path))
+    assert restarted.get('b') == 'B'
+    
+    expiring = ResponseCache(ttl=0)
+    expiring.set('k', 'v')
+    time.sleep(0.01)
+    assert expiring.get('k') is None
+
+
+def test_agent_response_cache():
+    """Test identical requests are served from the cache"""
+    from src.agents.cache import ResponseCache
+    
+    backend = LocalBackend()
+    agent = CardiologyAgent()
+    agent.backend = backend
+    agent.cache = ResponseCache()
+    
+    agent.analyze({'chief_complaint': 'chest pain'})
+    agent.analyze({'chief_complaint': 'chest pain'})
+    assert backend.stats['calls'] == 1
+    assert agent.cache_stats == {'hits': 1, 'misses': 1}
+    
+    agent.analyze({'chief_complaint': 'chest pain'}, use_cache=False)
+    assert backend.stats['calls'] == 2
+
+
+def test_model_limiter_bounds_concurrency():
+    """Test per-model semaphore caps in-flight async calls"""
+    from src.agents.rate_limit import configure_rate_limits, get_model_limiter
+    
+    configure_rate_limits({'ernie-test': {'max_concurrency': 2, 'rate': 1000, 'burst': 100}})
+    in_flight = []
+    peak = []
+    
+    async def call():
+        async with get_model_limiter('ernie-test'):
+            in_flight.append(1)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.pop()
+    
+    async def main():
+        await asyncio.gather(*(call() for _ in range(10)))
+    
+    asyncio.run(main())
+    configure_rate_limits({})
+    assert max(peak) == 2
+
+
+def test_diagnose_async():
+    """Test async diagnosis runs end to end"""
+    system = MultiAgentDiagnosticSystem({
+        'max_debate_rounds': 1,
+        'llm_backend': {'type': 'local', 'latency': 0.01,
+                        'responses': {'default': 'chest pain, ecg and ct findings'}}
+    })
+    
+    report = asyncio.run(system.diagnose_async({'raw_text': 'chest pain'}))
+    
+    assert report['metadata']['num_specialists'] == 2
+    assert report['metadata']['failed_specialists'] == {}
+    system.shutdown()
+
+
+def test_conversation_history_is_bounded(tmp_path):
+    """Test history ring buffer and spill log"""
+    from src.agents.history import ConversationHistory
+    
+    spill = tmp_path / 'history.jsonl'
+    history = ConversationHistory(max_entries=3, spill_path=str(spill))
+    for i in range(10):
+        history.append({'input': str(i), 'output': ''})
+    
+    assert [e['input'] for e in history] == ['7', '8', '9']
+    assert len(spill.read_text().splitlines()) == 10
+
+
+def test_history_is_scoped_to_case(tmp_path):
+    """Test a finished case leaves nothing in agent history"""
+    import json
+    
+    system = MultiAgentDiagnosticSystem({
+        'enable_debate': False,
+        'history': {'spill_dir': str(tmp_path)},
+        'llm_backend': {'type': 'local', 'responses': {'default': 'chest pain'}}
+    })
+    
+    report = system.diagnose({'raw_text': 'chest pain'}, case_id='case-1')
+    
+    assert report['metadata']['case_id'] == 'case-1'
+    assert len(system.analyzer.conversation_history) == 0
+    assert len(system.specialists['cardiology'].conversation_history) == 0
+    
+    spilled = (tmp_path / 'cardiology.jsonl').read_text().splitlines()
+    assert [json.loads(line)['case_id'] for line in spilled] == ['case-1']
+    system.shutdown()
+
+
+def test_diagnose_stream_events():
+    """Test streaming diagnosis yields tokens before the report"""
+    system = MultiAgentDiagnosticSystem({
+        'max_debate_rounds': 1,
+        'agent_timeout': 5,
+        'llm_backend': {'type': 'local', 'chunk_size': 8,
+                        'responses': {'default': 'chest pain and ct findings'}}
+    })
+    
+    events = list(system.diagnose_stream({'raw_text': 'chest pain'}, case_id='c-7'))
+    kinds = [e['event'] for e in events]
+    
+    assert kinds[0] == 'stage'
+    assert kinds.index('token') < kinds.index('specialties')
+    assert {e['source'] for e in events if e['event'] == 'token'} == {
+        'analyzer', 'cardiology', 'radiology'
+    }
+    assert kinds.count('opinion') == 2
+    assert kinds[-1] == 'report'
+    assert events[-1]['report']['metadata']['case_id'] == 'c-7'
+    system.shutdown()
+
+
+def test_keyword_automaton_overlapping_matches():
+    """Test automaton reports every overlapping keyword with positions"""
+    from src.agents.keyword_router import KeywordAutomaton
+    
+    automaton = KeywordAutomaton()
+    for word in ['he', 'she', 'his', 'hers']:
+        automaton.add(word, word)
+    
+    matches = [(start, end, kw) for start, end, kw, _ in automaton.finditer('ushers')]
+    assert matches == [(1, 4, 'she'), (2, 4, 'he'), (2, 6, 'hers')]
+
+
+def test_keyword_router_weights_and_routing():
+    """Test config-driven routing with weighted keywords"""
+    from src.agents.keyword_router import KeywordRouter
+    
+    router = KeywordRouter.from_config({
+        'min_score': 1.0,
+        'specialties': {
+            'cardiology': {'keywords': ['胸痛', {'term': 'murmur', 'weight': 0.5}]},
+            'oncology': {'weight': 2.0, 'keywords': ['癌']}
+        }
+    })
+    
+    assert router.score('Murmur 胸痛 murmur') == {'cardiology': 2.0, 'oncology': 0.0}
+    assert router.route('murmur') == ['cardiology']  # default specialty
+    assert router.route('肺癌 胸痛') == ['cardiology', 'oncology']
+    assert router.match('肺癌')[0].start == 1
+    
+    # Small lists are scanned per keyword; the automaton finds the same matches
+    specialties = {'a': {'keywords': ['he', 'she', 'his', 'hers', 'aa']},
+                   'b': {'weight': 0.5, 'keywords': ['hers', 'rs']}}
+    scan = KeywordRouter(specialties)
+    automaton = KeywordRouter(specialties, automaton_min_keywords=0)
+    assert scan.automaton is None and automaton.automaton is not None
+    for text in ['ushers', 'aaaa his hers', '']:
+        assert scan.match(text) == automaton.match(text)
+        assert scan.score(text) == automaton.score(text)
+
+
+def test_default_routing_matches_original_lists():
+    """Test default router keeps the original specialty selection"""
+    system = MultiAgentDiagnosticSystem({})
+    
+    assert system._determine_specialties({'summary': '胸痛 CT'}) == ['cardiology', 'radiology']
+    assert system._determine_specialties({'summary': 'malignant tumor'}) == ['oncology']
+    assert system._determine_specialties({'summary': 'fever'}) == ['cardiology']
+    system.shutdown()
+
+
+def test_diagnose_batch_dedup_and_isolation():
+    """Test batch deduplicates inputs and survives a failing case"""
+    system = MultiAgentDiagnosticSystem({
+        'enable_debate': False,
+        'batch': {'max_in_flight': 4, 'analysis_workers': 2, 'case_workers': 2}
+    })
+    analyzed = []
+    
+    def analyze(document, **kw):
+        analyzed.append(document['raw_text'])
+        if document['raw_text'] == 'boom':
+            raise RuntimeError('analyzer crashed')
+        time.sleep(0.3 if document['raw_text'] == 'slow' else 0.01)
+        return {'summary': document['raw_text']}
+    
+    system.analyzer.analyze = analyze
+    system.specialists['cardiology'].analyze = lambda data, **kw: {'summary': data['summary']}
+    
+    documents = [{'raw_text': t} for t in ['slow', 'heart', 'boom', 'heart', 'cardiac']]
+    results = list(system.diagnose_batch(documents))
+    
+    assert sorted(index for index, _ in results) == [0, 1, 2, 3, 4]
+    assert sorted(analyzed) == ['boom', 'cardiac', 'heart', 'slow']
+    assert results[-1][0] == 0  # slowest case finishes last
+    by_index = dict(results)
+    assert by_index[2] == {'error': 'analyzer crashed'}
+    assert by_index[1]['specialist_consultations'] == by_index[3]['specialist_consultations']
+    system.shutdown()
+
+
+def test_diagnose_batch_dedup_beyond_in_flight_window():
+    """Test duplicates arriving after the first case finished are not re-run"""
+    system = MultiAgentDiagnosticSystem({
+        'enable_debate': False,
+        'batch': {'max_in_flight': 2, 'analysis_workers': 2, 'case_workers': 2}
+    })
+    analyzed = []
+    
+    def analyze(document, **kw):
+        analyzed.append(document['raw_text'])
+        return {'summary': document['raw_text']}
+    
+    system.analyzer.analyze = analyze
+    system.specialists['cardiology'].analyze = lambda data, **kw: {'summary': data['summary']}
+    
+    documents = [{'raw_text': t} for t in ['a', 'b', 'c', 'd', 'a', 'b']]
+    results = dict(system.diagnose_batch(documents))
+    
+    assert sorted(results) == [0, 1, 2, 3, 4, 5]
+    assert sorted(analyzed) == ['a', 'b', 'c', 'd']
+    assert results[4]['specialist_consultations'] == results[0]['specialist_consultations']
+    assert results[4] is not results[0]
+    system.shutdown()
+
+
+def test_local_backend_latency_and_failures():
+    """Test local backend templating, latency and failure injection"""
+    from src.agents.llm_backend import LLMBackendError
+    
+    request = {'model': 'ernie-test',
+               'messages': [{'role': 'system', 'content': 'sys'},
+                            {'role': 'user', 'content': '胸痛 chest pain'}]}
+    
+    backend = LocalBackend(latency={'distribution': 'fixed', 'value': 0.05},
+                           responses={'ernie-test': 'echo: {input}'})
+    start = time.monotonic()
+    response = backend.complete(request)
+    assert time.monotonic() - start >= 0.05
+    assert response.text == 'echo: 胸痛 chest pain'
+    assert response.prompt_tokens > 0 and response.completion_tokens > 0
+    assert ''.join(backend.stream(request)) == response.text
+    
+    failing = LocalBackend(failure_rate=1.0, seed=1)
+    with pytest.raises(LLMBackendError):
+        failing.complete(request)
+    assert failing.stats['failures'] == 1
+
+
+def test_benchmark_harness_reports_percentiles():
+    """Test diagnose benchmark runs offline and reports metrics"""
+    from scripts.benchmark_diagnose import run_scenario
+    
+    result = run_scenario(specialties=2, debate_rounds=1, cases=4, concurrency=2,
+                          latency={'distribution': 'fixed', 'value': 0.001})
+    
+    assert result['cases'] == 4
+    assert result['calls'] >= 4 * 3
+    assert result['p50'] <= result['p99']
+    assert result['throughput'] > 0
+
+
+def test_revision_prompt_stays_within_budget():
+    """Test revision prompt size is bounded regardless of peer count"""
+    from src.agents.llm_backend import estimate_tokens
+    
+    agent = CardiologyAgent()
+    agent.revision_budget = 300
+    verbose = 'Diagnosis: pulmonary embolism. ' + 'Supporting detail sentence. ' * 100
+    
+    for peers in (2, 5, 10):
+        opinions = {f"specialist_{i}": {'summary': verbose} for i in range(peers)}
+        prompt = agent._create_revision_prompt(opinions)
+        assert estimate_tokens(prompt) <= 300
+        assert prompt.count('pulmonary embolism') == peers
+    
+    assert agent.prompt_stats['revision_tokens_saved'] > 0
+
+
+def test_short_revision_prompt_is_unchanged():
+    """Test opinions within budget are passed through verbatim"""
+    agent = CardiologyAgent()
+    prompt = agent._create_revision_prompt({'oncology': {'summary': 'No malignancy.'}})
+    
+    assert '**oncology**:\nNo malignancy.' in prompt
+    assert agent.prompt_stats['revision_tokens_saved'] == 0
+
+
+def test_llm_call_telemetry():
+    """Test agent calls are recorded with tokens, round and error class"""
+    from src.agents.resilience import configure_resilience
+    from src.agents.telemetry import LLMMetrics, debate_round
+    
+    metrics = LLMMetrics()
+    agent = CardiologyAgent()
+    agent.backend = LocalBackend(responses={'default': 'stable angina'})
+    agent.metrics = metrics
+    
+    agent.analyze({'chief_complaint': 'chest pain'})
+    with debate_round(2):
+        agent.backend = LocalBackend(failure_rate=1.0)
+        agent.revise({'oncology': {'summary': 'no tumour'}})
+    
+    labels = {'agent': agent.name, 'model': agent.model}
+    assert metrics.latency.count(round=0, **labels) == 1
+    assert metrics.calls.value(round=0, outcome='ok', error='', **labels) == 1
+    # One record per attempt: the failed revision was retried twice
+    assert metrics.calls.value(round=2, outcome='error', error='LLMBackendError', **labels) == 3
+    assert metrics.completion_tokens.count(round=2, **labels) == 0
+    
+    text = metrics.render()
+    assert '# TYPE medidoc_llm_request_duration_seconds histogram' in text
+    assert 'le="+Inf"' in text
+    configure_resilience({})
+
+
+def test_retries_with_jitter_then_circuit_opens():
+    """Test failed calls are retried and a failing model trips its breaker"""
+    from src.agents.resilience import CircuitOpenError, ModelResilience
+    
+    resilience = ModelResilience('m', max_attempts=3, base_delay=0.01,
+                                 failure_threshold=3, reset_timeout=0.1)
+    attempts = []
+    
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise TimeoutError('upstream stalled')
+        return 'ok'
+    
+    assert resilience.call(flaky) == 'ok'
+    assert resilience.stats['retries'] == 2
+    
+    def broken():
+        raise ConnectionError('down')
+    
+    with pytest.raises(ConnectionError):
+        resilience.call(broken)
+    assert resilience.breaker.state == 'open'
+    with pytest.raises(CircuitOpenError):
+        resilience.call(lambda: 'never called')
+    
+    time.sleep(0.15)
+    assert resilience.call(lambda: 'probe') == 'probe'
+    assert resilience.breaker.state == 'closed'
+
+
+def test_cancelled_probe_does_not_wedge_the_breaker():
+    """Test a cancelled or abandoned half-open probe frees the probe slot"""
+    from src.agents.llm_backend import LLMBackendError
+    from src.agents.resilience import ModelResilience
+    
+    def broken():
+        raise LLMBackendError('upstream 500')
+    
+    async def stuck():
+        await asyncio.sleep(1)
+    
+    resilience = ModelResilience('m', max_attempts=1, failure_threshold=1,
+                                 reset_timeout=0.05)
+    
+    # Probe cancelled by the caller's timeout
+    with pytest.raises(LLMBackendError):
+        resilience.call(broken)
+    time.sleep(0.06)
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(asyncio.wait_for(resilience.acall(stuck), 0.05))
+    assert resilience.call(lambda: 'probe') == 'probe'
+    assert resilience.breaker.state == 'closed'
+    
+    # Probe stream dropped by its consumer
+    with pytest.raises(LLMBackendError):
+        resilience.call(broken)
+    time.sleep(0.06)
+    stream = resilience.stream(lambda: iter(['first', 'second']))
+    assert next(stream) == 'first'
+    stream.close()
+    assert resilience.call(lambda: 'probe') == 'probe'
+    assert resilience.breaker.state == 'closed'
+
+
+def test_hedged_request_beats_stuck_call():
+    """Test a call slower than the latency percentile is hedged"""
+    from src.agents.resilience import ModelResilience
+    
+    resilience = ModelResilience('m', hedge_percentile=90, hedge_min_samples=5)
+    for _ in range(10):
+        resilience.latencies.observe(0.01)
+    calls = itertools.count()
+    
+    def attempt():
+        if next(calls) == 0:
+            time.sleep(1.0)
+            return 'stuck'
+        return 'hedge'
+    
+    start = time.monotonic()
+    assert resilience.call(attempt) == 'hedge'
+    assert time.monotonic() - start < 0.5
+    assert resilience.stats['hedge_wins'] == 1
+    
+    async def aattempt(delays=iter([1.0, 0.0])):
+        await asyncio.sleep(next(delays))
+        return 'done'
+    
+    start = time.monotonic()
+    assert asyncio.run(resilience.acall(aattempt)) == 'done'
+    assert time.monotonic() - start < 0.5
+
+
+def test_load_does_not_trigger_hedges():
+    """Test concurrent calls at normal latency are not hedged"""
+    from concurrent.futures import ThreadPoolExecutor
+    from src.agents.resilience import ModelResilience
+    
+    resilience = ModelResilience('m', hedge_percentile=95, hedge_min_samples=20)
+    for _ in range(20):
+        resilience.latencies.observe(0.2)
+    calls = itertools.count()
+    
+    def attempt():
+        next(calls)
+        time.sleep(0.1)
+        return 'ok'
+    
+    with ThreadPoolExecutor(max_workers=64) as callers:
+        results = list(callers.map(lambda _: resilience.call(attempt), range(64)))
+    
+    assert results == ['ok'] * 64
+    assert resilience.stats['hedges'] == 0
+    assert next(calls) == 64
+
+
+def test_non_transient_errors_are_not_retried():
+    """Test bad requests and cassette misses fail at once and spare the breaker"""
+    from src.agents.llm_backend import CassetteMissError
+    from src.agents.resilience import ModelResilience
+    
+    resilience = ModelResilience('m', max_attempts=3, base_delay=0.01, failure_threshold=1)
+    for error in (CassetteMissError('no entry'), ValueError('bad request')):
+        attempts = []
+        
+        def attempt():
+            attempts.append(1)
+            raise error
+        
+        with pytest.raises(type(error)):
+            resilience.call(attempt)
+        assert len(attempts) == 1
+    
+    assert resilience.stats['retries'] == 0
+    assert resilience.breaker.state == 'closed'
+
+
+def test_records_cache_normalized_text():
+    """Test records route on their values and recompute text after changes"""
+    from src.agents.records import Opinion, StructuredRecord
+    
+    record = StructuredRecord(summary='Chest PAIN', structured_data={'exam': 'ECG normal'})
+    assert record.text == 'chest pain ecg normal'
+    assert record.text is record.text
+    record['summary'] = 'Tumor'
+    assert record.text.startswith('tumor')
+    
+    opinion = Opinion(summary='s', diagnoses=[' Angina '])
+    assert opinion.diagnosis_set == {'angina'}
+    assert opinion.fingerprint == Opinion(summary='s', diagnoses=['angina']).fingerprint
+
+
+def test_routing_ignores_field_names():
+    """Test analyzer output is routed on content, not on its keys"""
+    system = MultiAgentDiagnosticSystem({})
+    analyzer = DocumentAnalyzerAgent()
+    analyzer.backend = LocalBackend(responses={'default': 'Chest pain for 3 days'})
+    
+    structured = analyzer.analyze({'raw_text': 'case'})
+    assert system._determine_specialties(structured) == ['cardiology']
+    system.shutdown()
+
+
+def test_report_versions_render_lazily(tmp_path):
+    """Test report versions are rendered on first access and memoized"""
+    system = MultiAgentDiagnosticSystem({})
+    calls = []
+    original = system._professional_report_lines
+    system._professional_report_lines = lambda *args: calls.append(1) or original(*args)
+    
+    opinions = {'cardiology': {'summary': 'Stable angina'}}
+    report = system._generate_report({}, opinions, system._merge_opinions(opinions))
+    versions = report['report_versions']
+    assert calls == []
+    
+    path = tmp_path / 'report.md'
+    with open(path, 'w', encoding='utf-8') as f:
+        versions.write('professional', f)
+    assert not versions.is_rendered('professional')
+    
+    text = versions['professional']
+    assert versions['professional'] is text
+    assert path.read_text(encoding='utf-8') == text
+    assert 'Stable angina' in text
+    assert len(calls) == 2
+    assert not versions.is_rendered('patient_friendly')
+    system.shutdown()
+
+
+def test_agent_registry_is_lazy_and_evicts_idle_agents():
+    """Test agents are built from roles on first use and evicted when idle"""
+    roles = [
+        {'name': 'document_analyzer', 'model': 'ernie-4.5-8b'},
+        {'name': 'cardiology_consultant', 'model': 'ernie-cardiology'},
+        {'name': 'medication_advisor', 'model': 'ernie-4.5-8b',
+         'system_prompt': 'You are a clinical pharmacist.'}
+    ]
+    system = MultiAgentDiagnosticSystem({'roles': roles, 'agent_idle_ttl': 60})
+    assert system.registry.loaded() == {}
+    assert list(system.specialists) == ['cardiology']
+    
+    cardiology = system.specialists['cardiology']
+    advisor = system.get_agent('medication_advisor')
+    assert isinstance(cardiology, CardiologyAgent)
+    assert advisor.get_system_prompt() == 'You are a clinical pharmacist.'
+    assert set(system.registry.loaded()) == {'cardiology_consultant', 'medication_advisor'}
+    
+    advisor.conversation_history.append({'input': 'q', 'output': 'a'})
+    evicted = system.registry.evict_idle(now=time.monotonic() + 120)
+    assert evicted == ['cardiology_consultant', 'medication_advisor']
+    assert len(advisor.conversation_history) == 0
+    assert system.get_agent('medication_advisor') is not advisor
+    system.shutdown()
+
+
+def test_engine_serves_concurrent_cases_without_crosstalk(tmp_path):
+    """Stress test: one engine, many threads and coroutines, isolated cases"""
+    import json
+    import re
+    from concurrent.futures import ThreadPoolExecutor
+    
+    system = MultiAgentDiagnosticSystem({
+        'max_debate_rounds': 2,
+        'agent_workers': 32,
+        'response_cache': {'enabled': True},
+        'history': {'spill_dir': str(tmp_path)},
+        'llm_backend': {'type': 'local', 'seed': 7,
+                        'latency': {'distribution': 'uniform', 'low': 0.0, 'high': 0.01},
+                        'responses': {'ernie-4.5-8b': 'Chest pain, MRI tumor. {input}',
+                                      'default': '[{model}] view #{call}'}}
+    })
+    
+    def run(i):
+        report = system.diagnose({'raw_text': f"patient-{i}"}, case_id=f"case-{i}")
+        return i, report
+    
+    async def run_async(indices):
+        reports = await asyncio.gather(*(
+            system.diagnose_async({'raw_text': f"patient-{i}"}, case_id=f"case-{i}")
+            for i in indices
+        ))
+        return list(zip(indices, reports))
+    
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        threaded = pool.map(run, range(40))
+        async_results = pool.submit(asyncio.run, run_async(range(40, 50)))
+        results = list(threaded) + async_results.result()
+    
+    for i, report in results:
+        assert report['metadata']['case_id'] == f"case-{i}"
+        assert re.findall(r'patient-\d+', report['patient_data']['summary']) == [f"patient-{i}"]
+        assert report['metadata']['num_specialists'] == 3
+    
+    # Every exchange was tagged with the case that produced it
+    for line in (tmp_path / 'analyzer.jsonl').read_text().splitlines():
+        entry = json.loads(line)
+        assert re.search(r'patient-(\d+)', entry['input']).group(1) == entry['case_id'][5:]
+    
+    assert all(len(agent.conversation_history) == 0 for agent in system._all_agents().values())
+    assert system.cache_stats()['analyzer'] == {'hits': 0, 'misses': 50}
+    system.shutdown()
+
+
+def test_cassette_records_and_replays_diagnosis(tmp_path):
+    """Test a recorded diagnosis replays offline with identical results"""
+    from src.agents.llm_backend import CassetteBackend, CassetteMissError
+    
+    path = str(tmp_path / 'session.jsonl.gz')
+    document = {'raw_text': 'Chest pain, MRI shows a lesion'}
+    recorder = CassetteBackend(path, mode='record', backend=LocalBackend(
+        latency=0.05, responses={'default': '[{model}] Findings: {input}'}
+    ))
+    system = MultiAgentDiagnosticSystem({'max_debate_rounds': 1})
+    system.backend = recorder
+    recorded = system.diagnose(document)
+    system.shutdown()
+    assert recorder.stats['recorded'] == recorder.backend.stats['calls']
+    
+    system = MultiAgentDiagnosticSystem({
+        'max_debate_rounds': 1,
+        'llm_backend': {'type': 'cassette', 'path': path, 'replay_latency': True}
+    })
+    start = time.monotonic()
+    replayed = system.diagnose(document)
+    assert time.monotonic() - start >= 0.1
+    assert replayed['specialist_consultations'] == recorded['specialist_consultations']
+    assert replayed['report_versions']['professional'] == recorded['report_versions']['professional']
+    assert system.backend.stats == {'recorded': 0, 'replayed': recorder.stats['recorded'],
+                                    'misses': 0}
+    
+    with pytest.raises(CassetteMissError):
+        system.backend.complete({'model': 'ernie-4.5-8b',
+                                 'messages': [{'role': 'user', 'content': 'unseen'}]})
+    system.shutdown()
+
+
 if __name__ == "__main__":
     pytest.main([__file__, '-v'])
@@ -48,5 +48,241 @@ def test_to_markdown():
     assert 'Patient Information' in markdown
 
 
+class FakeOCR:
+    """Reports each page's width instead of running PaddleOCR"""
+    
+    def __init__(self, config=None):
+        self.shapes = []
+    
+    def ocr(self, image, cls=True):
+        self.shapes.append(image.shape)
+        return [[[[[0, 0], [1, 0], [1, 1], [0, 1]], (f"{image.shape[1]}px", 0.9)]]]
+
+
+def make_pdf(path, pages):
+    """PDF whose pages are 144, 216, 288, ... points wide"""
+    import pymupdf
+    
+    document = pymupdf.open()
+    for index in range(pages):
+        page = document.new_page(width=144 + 72 * index, height=72)
+        page.insert_text((10, 40), f"Page {index + 1}")
+    document.save(str(path))
+    document.close()
+
+
+def test_pdf_pages_are_rasterized_lazily(tmp_path):
+    """Test PDF pages stream one at a time at the configured DPI"""
+    import types
+    
+    path = tmp_path / 'referral.pdf'
+    make_pdf(path, pages=3)
+    processor = MedicalDocumentProcessor({'use_gpu': False, 'pdf_dpi': 144})
+    
+    pages = processor._pdf_to_images(str(path))
+    assert isinstance(pages, types.GeneratorType)
+    first = next(pages)
+    assert first.shape == (144, 288, 3)
+    assert len(list(pages)) == 2
+    
+    processor._ocr = FakeOCR()
+    result = processor.process_pdf(str(path))
+    assert result['raw_text'] == '288px\n432px\n576px'
+    assert len(processor._ocr.shapes) == 3
+
+
+@pytest.mark.slow
+def test_pdf_pages_are_ocred_in_worker_processes(tmp_path):
+    """Test page-parallel OCR reassembles results in page order"""
+    path = tmp_path / 'packet.pdf'
+    make_pdf(path, pages=7)
+    processor = MedicalDocumentProcessor({'use_gpu': False, 'pdf_dpi': 72,
+                                          'workers': 2, 'worker_threads': 1})
+    processor.engine_factory = FakeOCR
+    
+    try:
+        result = processor.process_pdf(str(path))
+    finally:
+        processor.close()
+    
+    assert result['raw_text'].split('\n') == [f"{144 + 72 * i}px" for i in range(7)]
+    assert processor._ocr is None
+
+
+class FakeDetRecOCR:
+    """
+    Stand-in engine with PaddleOCR's det-only, rec-only and full modes
+    
+    Detection returns the boxes registered for an image's shape (in
+    scrambled order); recognition reads a crop's gray level as its text.
+    """
+    
+    drop_score = 0.5
+    
+    def __init__(self, boxes_by_shape):
+        self.boxes_by_shape = boxes_by_shape
+        self.rec_batches = []
+    
+    def _recognize(self, crops):
+        self.rec_batches.append(len(crops))
+        return [(f"gray {int(round(crop.mean()))}", 0.3 if crop.mean() > 150 else 0.9)
+                for crop in crops]
+    
+    def ocr(self, img, det=True, rec=True, cls=True):
+        from src.ocr.document_processor import crop_text_line, sort_boxes
+        
+        if not det:
+            return [self._recognize(img[0])]
+        boxes = self.boxes_by_shape.get(img.shape[:2])
+        if not rec:
+            return [boxes[::-1] if boxes else None]
+        if not boxes:
+            return [None]
+        ordered = sort_boxes(boxes)
+        lines = self._recognize([crop_text_line(img, box) for box in ordered])
+        return [[[box.tolist(), line] for box, line in zip(ordered, lines) if line[1] >= 0.5]]
+
+
+def test_process_images_batches_recognition_across_images(tmp_path):
+    """Test batched multi-image OCR matches per-image results"""
+    import cv2
+    import numpy as np
+    
+    paths = []
+    boxes_by_shape = {}
+    for index in range(5):
+        image = np.full((100 + index, 200, 3), 255, dtype=np.uint8)
+        boxes = []
+        for line, gray in enumerate((10 * index, 50, 200)):
+            top = 10 + 30 * line
+            image[top:top + 20, 20:180] = gray
+            boxes.append([[20, top], [180, top], [180, top + 20], [20, top + 20]])
+        boxes_by_shape[image.shape[:2]] = boxes
+        path = tmp_path / f"photo_{index}.png"
+        cv2.imwrite(str(path), image)
+        paths.append(str(path))
+    paths.insert(2, str(tmp_path / 'missing.png'))
+    
+    processor = MedicalDocumentProcessor({'use_gpu': False, 'image_batch_size': 4})
+    processor._ocr = FakeDetRecOCR(boxes_by_shape)
+    
+    batched = processor.process_images(paths)
+    assert processor._ocr.rec_batches == [9, 6]
+    assert batched[2]['error'] == 'could not read image'
+    
+    del batched[2], paths[2]
+    for path, result in zip(paths, batched):
+        assert result == processor.process_image(path)
+    assert batched[1]['raw_text'] == 'gray 10\ngray 50'
+
+
+def test_process_images_bounds_decoded_images_in_flight():
+    """Test decoding runs a bounded window ahead of recognition"""
+    import threading
+    
+    processor = MedicalDocumentProcessor({'use_gpu': False, 'image_batch_size': 4,
+                                          'decode_workers': 2})
+    loaded = []
+    lock = threading.Lock()
+    
+    def load(path):
+        with lock:
+            loaded.append(path)
+        return None, None, None
+    
+    loaded_at_batch = []
+    
+    def recognize(batch):
+        loaded_at_batch.append(len(loaded))
+        return [{'path': path} for path, *_ in batch]
+    
+    processor._load_image = load
+    processor._recognize_batch = recognize
+    
+    paths = [f"image_{index}.png" for index in range(40)]
+    results = processor.process_images(paths)
+    
+    assert [result['path'] for result in results] == paths
+    assert len(loaded_at_batch) == 10
+    assert max(count - 4 * batch for batch, count in enumerate(loaded_at_batch)) <= 6
+
+
+def test_repeat_uploads_are_served_from_the_result_cache(tmp_path):
+    """Test OCR results are cached by content hash in memory and on disk"""
+    import os
+    import shutil
+    from src.ocr.cache import OCRResultCache
+    
+    path = tmp_path / 'referral.pdf'
+    make_pdf(path, pages=2)
+    copy = tmp_path / 'referral (1).pdf'
+    shutil.copy(path, copy)
+    config = {'use_gpu': False, 'pdf_dpi': 72,
+              'cache': {'enabled': True, 'disk_dir': str(tmp_path / 'ocr_cache')}}
+    
+    processor = MedicalDocumentProcessor(config)
+    processor._ocr = FakeOCR()
+    first = processor.process_pdf(str(path))
+    assert processor.process_pdf(str(copy)) == first
+    assert len(processor._ocr.shapes) == 2
+    assert processor.cache.stats['hits'] == 1
+    
+    # A fresh processor reads the disk tier; another DPI is another entry
+    restarted = MedicalDocumentProcessor(config)
+    restarted._ocr = FakeOCR()
+    assert restarted.process_pdf(str(copy)) == first
+    assert restarted._ocr.shapes == []
+    assert restarted.cache.stats['disk_hits'] == 1
+    
+    other_dpi = MedicalDocumentProcessor(dict(config, pdf_dpi=144))
+    other_dpi._ocr = FakeOCR()
+    assert other_dpi.process_pdf(str(path))['raw_text'] == '288px\n432px'
+    
+    # The disk tier stays under its size cap, dropping the oldest entries
+    cache = OCRResultCache(disk_dir=str(tmp_path / 'small'), max_disk_bytes=300)
+    for index in range(5):
+        lines = [([[0, 0], [9, 0], [9, 9], [0, 9]], os.urandom(32).hex(), 0.9)]
+        cache.set(f"{index:064x}", [lines])
+    assert cache.disk_usage() <= 300
+    assert cache.stats['evicted'] > 0
+    cache.clear()
+    assert cache.get(f"{4:064x}") == [[tuple(line) for line in lines]]
+    assert cache.get(f"{0:064x}") is None
+    
+    # Engine settings that change the numeric path are part of the key
+    key = OCRResultCache.make_key('digest', config)
+    assert key != OCRResultCache.make_key('digest', dict(config, workers=4))
+    assert key != OCRResultCache.make_key('digest', dict(config, cpu_threads=4))
+
+
+def test_preprocessing_downscales_deskews_and_crops():
+    """Test the preprocessing steps and their per-step timings"""
+    import numpy as np
+    from src.ocr.preprocessing import ImagePreprocessor, estimate_skew, rotate
+    
+    page = np.full((1500, 2000, 3), 255, dtype=np.uint8)
+    for line in range(10):
+        page[300 + 80 * line:330 + 80 * line, 400:1600] = 30
+    skewed = rotate(page, 4)
+    assert round(estimate_skew(skewed)) == 4
+    
+    preprocessor = ImagePreprocessor({'enabled': True, 'max_side': 1000, 'color': 'binarize',
+                                      'deskew': True, 'crop_margins': True, 'margin': 10})
+    timings = {}
+    result = preprocessor(skewed, timings)
+    
+    assert list(timings) == ['downscale', 'deskew', 'crop_margins', 'binarize']
+    assert result.ndim == 3 and set(np.unique(result)) <= {0, 255}
+    assert abs(estimate_skew(result)) < 0.5
+    # Text block is 600 x ~370 px at half scale, plus the margins
+    assert 600 <= result.shape[1] <= 640 and 370 <= result.shape[0] <= 420
+    assert ImagePreprocessor({'max_side': 1000})(skewed) is skewed
+    
+    # Preprocessing settings change OCR output, so they are part of the cache key
+    from src.ocr.cache import OCRResultCache
+    assert (OCRResultCache.make_key('digest', {'lang': 'ch'})
+            != OCRResultCache.make_key('digest', {'lang': 'ch', 'preprocessing': {'enabled': True}}))
+
+
 if __name__ == "__main__":
     pytest.main([__file__, '-v'])
@@ -39,3 +39,61 @@ def test_diagnose_endpoint(client):
     assert response.status_code == 200
     data = response.get_json()
     assert 'diagnosis' in data
+
+
+def test_diagnose_stream_endpoint(client, monkeypatch):
+    """Test streaming diagnosis emits server-sent events"""
+    from src.web import app as web_app
+    
+    class FakeSystem:
+        def diagnose_stream(self, document, case_id=None):
+            yield {'event': 'token', 'source': 'analyzer', 'text': document['raw_text']}
+            yield {'event': 'report', 'report': {'metadata': {}}}
+    
+    monkeypatch.setattr(web_app, 'get_diagnostic_system', lambda: FakeSystem())
+    response = client.post('/api/diagnose/stream', json={'document': '胸痛'})
+    
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    body = response.get_data(as_text=True)
+    assert 'event: token' in body
+    assert '胸痛' in body
+    assert body.rstrip().splitlines()[-2] == 'event: report'
+
+
+def test_metrics_endpoint(client):
+    """Test Prometheus metrics endpoint"""
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert '# TYPE medidoc_llm_requests_total counter' in response.get_data(as_text=True)
+
+
+def test_diagnose_report_endpoint(client, monkeypatch):
+    """Test a single report version is streamed as Markdown"""
+    from src.agents.records import Report, ReportVersions
+    from src.web import app as web_app
+    
+    diagnosed = []
+    
+    class FakeSystem:
+        def diagnose(self, document, case_id=None):
+            diagnosed.append(document)
+            return Report({
+                'report_versions': ReportVersions({
+                    'professional': lambda: iter(['# Report', document['raw_text']])
+                }),
+                'metadata': {'case_id': 'case_1'}
+            })
+    
+    monkeypatch.setattr(web_app, 'get_diagnostic_system', lambda: FakeSystem())
+    response = client.post('/api/diagnose/report', json={'document': '胸痛'})
+    
+    assert response.status_code == 200
+    assert response.mimetype == 'text/markdown'
+    assert response.headers['X-Case-Id'] == 'case_1'
+    assert response.get_data(as_text=True) == '# Report\n胸痛'
+    
+    response = client.post('/api/diagnose/report', json={'version': 'summary'})
+    assert response.status_code == 400
+    assert len(diagnosed) == 1  # rejected without a diagnosis run